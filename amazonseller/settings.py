@@ -17,10 +17,14 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONFIG_DIR = os.path.join(os.path.dirname(BASE_DIR), 'config')
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'media')
 LOG_DIR = os.path.join(os.path.dirname(BASE_DIR), 'logs')
+METRICS_DIR = os.path.join(os.path.dirname(BASE_DIR), 'metrics')
+ARCHIVE_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'archive')
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
 
+METRICS_TOKEN = None
+
 with open(os.path.join(CONFIG_DIR, 'keys.txt')) as keys_file:
     for line in keys_file:
         if line[0] == '#':
@@ -32,6 +36,8 @@ with open(os.path.join(CONFIG_DIR, 'keys.txt')) as keys_file:
             MWS_ACCESS_KEY = key_value_pair[1]
         elif key_value_pair[0] == 'mws_secret_key':
             MWS_SECRET_KEY = key_value_pair[1]
+        elif key_value_pair[0] == 'metrics_token':
+            METRICS_TOKEN = key_value_pair[1]
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = False
@@ -48,7 +54,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'custom_auth.apps.AuthConfig',
-    'store',
+    'store.apps.StoreConfig',
 ]
 
 MIDDLEWARE = [
@@ -59,7 +65,10 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.metrics.MetricsMiddleware',
+    'store.profiling.ProfilingMiddleware',
     'utils.thread_local.ThreadLocalMiddleware',
+    'utils.db.ReplicaPinMiddleware',
     'utils.aws.HandleBusinessExceptionMiddleware',
 ]
 
@@ -92,6 +101,13 @@ DATABASES = {
     }
 }
 
+# Aliases in DATABASES that are read-only copies of 'default', e.g. PostgreSQL streaming replicas
+# declared with 'TEST': {'MIRROR': 'default'}. utils.db.ReplicaRouter sends the reads of GET admin
+# requests to them; a browser that wrote reads from 'default' for DATABASE_REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_PIN_SECONDS = 10
+DATABASE_ROUTERS = ['utils.db.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -138,6 +154,69 @@ STATIC_URL = '/static/'
 
 AUTH_USER_MODEL = 'custom_auth.User'
 
+# Submitted feed bodies and downloaded processing reports are kept, compressed, under ARCHIVE_ROOT.
+# Entries older than ARCHIVE_RETENTION_DAYS are dropped by the prune_feed_archive command.
+ARCHIVE_RETENTION_DAYS = 180
+# Completed feeds older than FEED_RETENTION_DAYS, and their links to Inventory, are moved to the
+# FeedSubmissionArchive summary table by the archive_feeds command, FEED_RETENTION_BATCH_SIZE feeds at a time.
+FEED_RETENTION_DAYS = 30
+FEED_RETENTION_BATCH_SIZE = 200
+# Uploaded inventory files are kept compressed, once per content; the latest UPLOAD_HISTORY_COUNT
+# uploads of each store are listed and kept, older ones are deleted.
+UPLOAD_HISTORY_COUNT = 20
+# Files in a store's upload directory that no upload refers to, e.g. left by a failed request, are
+# deleted by the next upload once they are UPLOAD_STALE_SECONDS old.
+UPLOAD_STALE_SECONDS = 24 * 3600
+
+# /metrics serves utils.metrics in the Prometheus text format to METRICS_ALLOWED_IPS, for staff users or a
+# scraper sending "Authorization: Bearer <metrics_token from keys.txt>". Every process writes
+# its totals to METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds and /metrics adds them up, so
+# empty METRICS_DIR when the application is restarted (e.g. from gunicorn's on_starting hook).
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+METRICS_FLUSH_INTERVAL = 5
+
+# store.profiling.ProfilingMiddleware samples the stacks and logs the SQL of requests a superuser sends with
+# an "X-Profile: 1" header or a "_profile" query flag, plus a PROFILE_SAMPLE_RATE fraction of all requests.
+# Stacks are sampled every PROFILE_INTERVAL seconds; the latest PROFILE_HISTORY_COUNT profiles are kept.
+PROFILE_SAMPLE_RATE = 0
+PROFILE_INTERVAL = 0.005
+PROFILE_HISTORY_COUNT = 50
+
+# Every MWS call is traced (utils.mws_trace): the last MWS_TRACE_BUFFER_SIZE traces are kept in memory and,
+# with MWS_TRACE_TABLE, stored as MwsCall rows for MWS_TRACE_RETENTION_DAYS days. Calls are paced by the
+# reported quota: evenly until its reset once less than MWS_QUOTA_PACE_BELOW of it is left, and for
+# MWS_THROTTLE_BACKOFF seconds after a throttled call. Waits longer than MWS_MAX_PACE_SECONDS raise
+# ThrottlingException instead.
+MWS_TRACE_BUFFER_SIZE = 500
+MWS_TRACE_TABLE = False
+MWS_TRACE_RETENTION_DAYS = 7
+MWS_QUOTA_PACE_BELOW = 0.2
+MWS_THROTTLE_BACKOFF = 2
+MWS_MAX_PACE_SECONDS = 30
+
+# Stores are fed to MWS concurrently: at most MWS_SYNC_MAX_WORKERS submissions per process,
+# and at most MWS_SYNC_MAX_PER_SELLER at a time for the same seller account.
+MWS_SYNC_MAX_WORKERS = 4
+MWS_SYNC_MAX_PER_SELLER = 1
+# Items per submitted feed; larger selections are fed in several chunks.
+SYNC_CHUNK_SIZE = 5000
+
+# Admin changelists count matches exactly up to ADMIN_EXACT_COUNT_LIMIT rows. Beyond that the
+# count is estimated and cached counts are reused for ADMIN_COUNT_CACHE_TIMEOUT seconds.
+ADMIN_EXACT_COUNT_LIMIT = 10000
+ADMIN_COUNT_CACHE_TIMEOUT = 300
+
+# Applied to every SQLite connection (utils.db.configure_sqlite). WAL lets readers run alongside the
+# writer and, with synchronous=NORMAL, commits no longer fsync; cache_size is in KiB when negative.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 LOGGING = {
@@ -1,41 +1,109 @@
 import json
 import logging
+import uuid
 
 from django import forms
+from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin import helpers
-from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR, SEARCH_VAR, IGNORED_PARAMS
 from django.contrib.auth import get_permission_codename
 from django.core.exceptions import PermissionDenied
-from django.db import router
-from django.db.models import Q
+from django.core.paginator import InvalidPage
+from django.db import router, transaction
+from django.db.models import Q, Min
 from django.forms import models
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.template.response import TemplateResponse
-from django.urls import reverse, NoReverseMatch
-from django.contrib.admin.actions import delete_selected as delete_selected_
+from django.urls import reverse, NoReverseMatch, path
+from django.contrib.admin.models import LogEntry, DELETION
+from django.contrib.admin.options import get_content_type_for_model
 from django.contrib.admin.utils import (
-    quote,
+    quote, unquote,
     model_ngettext, NestedObjects)
 from django.utils.decorators import method_decorator
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
+from django.utils.text import slugify
 from django.utils.safestring import mark_safe
-from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from mws import MWSError
 
-from store.models import Store, StoreForm, StoreFile, inventory_form_factory, Inventory, FeedSubmissionInfo
-from utils.aws import update_store, ThrottlingException, get_feed_submission_list, get_feed_submission_result, \
-    DataCorruptionException
+from store.history import inventory_as_of, rollback_store
+from store.models import Store, StoreForm, StoreFile, inventory_form_factory, Inventory, FeedSubmissionInfo, \
+    FeedSubmissionArchive, InventoryChange, InventoryUpload, RequestProfile, MwsCall, CSV_COLUMNS, \
+    EXPORT_COLUMNS, update_inventory_stats, stored_inventory_count
+from store.search import search_inventory
+from store.uploads import InventoryUploadHandler
+from store.sync import sync_stores, sync_pending_stores
+from utils.aws import get_feed_submission_list, get_feed_submission_result, DataCorruptionException
+from utils.csv_export import streaming_csv_response
+from utils.db import chunked_queryset, write_lane, replica_reads
+from utils.helper import mws_normalize_condition, get_conditions_tuple
+from utils.paginator import SeekPaginator
 from utils.thread_local import get_current_user
 
 
 logger = logging.getLogger(__name__)
 csrf_protect_m = method_decorator(csrf_protect)
 
+CURSOR_VAR = 'cursor'
+_CONFIRMATION_SAMPLE_SIZE = 100
+_DELETE_CHUNK_SIZE = 1000
+_FEED_ITEMS_PER_PAGE = 200
+_EXPORT_CHUNK_SIZE = 2000
+
 
 class StoreAdmin(admin.ModelAdmin):
     form = StoreForm
     readonly_fields = ('csv', 'csv_datetime', 'csv_update_number')
+    actions = ['sync_pending_inventory', 'export_inventory']
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/export/', self.admin_site.admin_view(self.export_inventory_view),
+                 name='store_store_export'),
+        ] + super().get_urls()
+
+    def export_inventory(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, 'Select a single store to export its inventory.', messages.WARNING)
+            return None
+        return HttpResponseRedirect(reverse('admin:store_store_export', args=(quote(queryset[0].pk),),
+                                            current_app=self.admin_site.name))
+
+    export_inventory.short_description = 'Export inventory as CSV'
+
+    def export_inventory_view(self, request, object_id):
+        store = self.get_object(request, unquote(object_id))
+        if store is None:
+            raise Http404('Store with ID "%s" doesn\'t exist.' % object_id)
+        if not self.has_view_permission(request, store):
+            raise PermissionDenied
+        conditions = dict(get_conditions_tuple())
+        sync_statuses = dict(Inventory.SYNC_STATUS_CHOICES)
+        condition_index = CSV_COLUMNS.index('condition')
+        header = [Inventory._meta.get_field(column).verbose_name for column in EXPORT_COLUMNS]
+
+        def rows():
+            items = Inventory.objects.filter(store=store).order_by('sku').values_list(*EXPORT_COLUMNS)
+            for row in items.iterator(chunk_size=_EXPORT_CHUNK_SIZE):
+                row = list(row)
+                row[condition_index] = conditions.get(row[condition_index], row[condition_index])
+                row[-1] = sync_statuses.get(row[-1], row[-1])
+                yield row
+
+        return streaming_csv_response('%s_inventory.csv' % slugify(store.name), header, rows())
+
+    def sync_pending_inventory(self, request, queryset):
+        report_sync_results(self, request, sync_pending_stores(queryset))
+
+    sync_pending_inventory.short_description = 'Feed all pending Inventory -> Marketplace'
+    sync_pending_inventory.allowed_permissions = ('sync',)
+
+    def has_sync_permission(self, request, obj=None):
+        if request.user.is_superuser or request.user.store:
+            return request.user.has_perm('store.sync_inventory')
+        return False
 
     def has_add_permission(self, request):
         if request.user.is_superuser:
@@ -90,6 +158,44 @@ class UpdateInventoryAdmin(admin.ModelAdmin):
     def get_changelist(self, request, **kwargs):
         return UpdateInventoryChangeList
 
+    def get_urls(self):
+        change_view = self.admin_site.admin_view(self.change_view)
+
+        # CSRF is checked by change_view: the middleware would read the upload before the handler is in place.
+        @csrf_exempt
+        def upload_view(request, object_id):
+            store = None
+            if request.method == 'POST' and self.admin_site.has_permission(request):
+                store = self.get_object(request, unquote(object_id))
+            if store is None or not self.has_change_permission(request, store):
+                return change_view(request, object_id)
+            handler = InventoryUploadHandler(request, store)
+            request.upload_handlers.insert(0, handler)
+            try:
+                return change_view(request, object_id)
+            finally:
+                handler.discard()
+
+        return [
+            path('<path:object_id>/change/', upload_view, name='store_storefile_change'),
+        ] + super(UpdateInventoryAdmin, self).get_urls()
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        if request.method != 'POST':
+            return super(UpdateInventoryAdmin, self).changeform_view(request, object_id, form_url, extra_context)
+        # The save runs in the changeform transaction, which keeps SQLite's write lock from the upload's first
+        # write until it commits: take the write lane before that transaction starts.
+        with write_lane():
+            return super(UpdateInventoryAdmin, self).changeform_view(request, object_id, form_url, extra_context)
+
+    def save_model(self, request, obj, form, change):
+        super(UpdateInventoryAdmin, self).save_model(request, obj, form, change)
+        upload = obj.inventoryupload_set.order_by('-date', '-id').first()
+        if upload is not None and not upload.imported:
+            self.message_user(request, '%(file)s is identical to the previous upload of %(store)s: nothing to import.' % {
+                'file': upload.csv_filename, 'store': obj
+            }, messages.WARNING)
+
     def get_form(self, request, obj=None, change=False, **kwargs):
         self.form = inventory_form_factory(request, obj)
         return super(UpdateInventoryAdmin, self).get_form(request, obj, change, **kwargs)
@@ -116,6 +222,39 @@ class UpdateInventoryChangeList(ChangeList):
 admin.site.register(StoreFile, UpdateInventoryAdmin)
 
 
+class InventoryUploadAdmin(admin.ModelAdmin):
+    list_display = ('csv_filename', 'csv_update_number', 'imported', 'size', 'row_count', 'sha256', 'date', 'store')
+    list_filter = ('imported',)
+    search_fields = ('csv_filename', '=sha256')
+    list_select_related = ('store',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_view_permission(self, request, obj=None):
+        if request.user.is_superuser or request.user.store:
+            return super(InventoryUploadAdmin, self).has_view_permission(request, obj)
+        return False
+
+    def get_queryset(self, request):
+        qs = super(InventoryUploadAdmin, self).get_queryset(request)
+        if not request.user.is_superuser:
+            if request.user.store:
+                qs = qs.filter(store=request.user.store)
+            else:
+                qs = qs.filter(id=None)
+        return qs
+
+
+admin.site.register(InventoryUpload, InventoryUploadAdmin)
+
+
 class InventoryCreationForm(models.ModelForm):
     class Meta:
         model = Inventory
@@ -155,72 +294,27 @@ class ActionForm(forms.Form):
 
 def update_aws(modeladmin, request, queryset, operation):
     if request.method == 'POST':
-        n = queryset.count()
-        if n:
-            objects = set()
-            throttlings = set()
-            for obj in queryset.order_by('store'):
-                if obj.store is None:
-                    continue
-                # obj_display = str(obj)
-                if len(objects):
-                    previous_obj = objects.pop()
-                    objects.add(previous_obj)
-                    if previous_obj.store.id != obj.store.id:
-                        call_mws(objects, previous_obj, throttlings, operation)
-                        objects.clear()
-                objects.add(obj)
-            if len(objects):
-                previous_obj = objects.pop()
-                objects.add(previous_obj)
-                call_mws(objects, previous_obj, throttlings, operation)
-                # modeladmin.log_deletion(request, obj, obj_display)
-                if len(throttlings):
-                    for throttling in throttlings:
-                        modeladmin.message_user(request, str(throttling), messages.WARNING)
-                else:
-                    modeladmin.message_user(request, 'Successfully fed %(count)d %(items)s.' % {
-                        "count": n, "items": model_ngettext(modeladmin.opts, n)
-                    }, messages.SUCCESS)
+        report_sync_results(modeladmin, request, sync_stores(queryset, operation))
     # Return None to display the change list page again.
     return None
 
 
-def call_mws(objects, previous_obj, throttling, operation):
-    try:
-        store = Store.objects.get(seller_id=previous_obj.store.seller_id)
-        store.last_execution, product_return, price_return, inventory_return = update_store(store,
-                                                                                            objects,
-                                                                                            operation)
-        store.save()
-        feed_infos = []
-        if product_return:
-            feed_infos.append(save_return(product_return['FeedSubmissionInfo'], store))
-        if price_return:
-            feed_infos.append(save_return(price_return['FeedSubmissionInfo'], store))
-        if inventory_return:
-            feed_infos.append(save_return(inventory_return['FeedSubmissionInfo'], store))
-        for item in objects:
-            item.sync_status = 1
-            for feed_info in feed_infos:
-                item.feed_submission_info.add(feed_info)
-        Inventory.objects.bulk_update(objects, ['sync_status'])
-    except ThrottlingException as e:
-        throttling.add(e)
-
-
-def save_return(feed_submission_info, store):
-    feed_submission_id = feed_submission_info['FeedSubmissionId']['value']
-    feed_type = feed_submission_info['FeedType']['value']
-    submitted_date = feed_submission_info['SubmittedDate']['value']
-    feed_processing_status = feed_submission_info['FeedProcessingStatus']['value']
-    feed_info = FeedSubmissionInfo(feed_submission_id=feed_submission_id,
-                                   feed_type=feed_type,
-                                   submitted_date=submitted_date,
-                                   feed_processing_status=feed_processing_status,
-                                   store=store)
-    feed_info.save()
-    return feed_info
+def report_sync_results(modeladmin, request, results):
+    for result in results:
+        if result.throttled:
+            modeladmin.message_user(request, str(result.error), messages.WARNING)
+        elif result.error is not None:
+            modeladmin.message_user(request, '%(store)s: Amazon was unable to process your action, please check '
+                                             'the logs for more details.' % {'store': result.store},
+                                    messages.ERROR)
+        elif not result.count:
+            modeladmin.message_user(request, '%(store)s: Nothing pending to feed.' % {'store': result.store},
+                                    messages.INFO)
+        else:
+            modeladmin.message_user(request, '%(store)s: Successfully fed %(count)d %(items)s.' % {
+                "store": result.store, "count": result.count,
+                "items": model_ngettext(Inventory._meta, result.count)
+            }, messages.SUCCESS)
 
 
 class FeedObjects(NestedObjects):
@@ -250,48 +344,69 @@ class FeedObjects(NestedObjects):
         return roots
 
 
-def get_synced_objects(modeladmin, objs, request, admin_site):
+def get_selection_summary(queryset, admin_site):
     """
-    Find all objects related to ``objs`` that should also be deleted. ``objs``
-    must be a homogeneous iterable of objects (e.g. a QuerySet).
-
-    Return a nested list of strings suitable for display in the
-    template with the ``unordered_list`` filter.
+    Describe the objects an action is about to touch without loading them all:
+    links to at most ``_CONFIRMATION_SAMPLE_SIZE`` of them and the total count.
     """
-    try:
-        objs[0]
-    except IndexError:
-        return [], {}, set(), []
-    else:
-        using = router.db_for_write(Inventory)
-    collector = FeedObjects(using=using)
-    collector.collect(objs)
-    perms_needed = set()
-
     def format_callback(obj):
-        no_edit_link = 'Inventory: %s' % (obj,)
-
-        if not modeladmin.has_sync_permission(request, obj):
-            perms_needed.add('Inventory')
         try:
             admin_url = reverse('%s:store_inventory_change'
                                 % (admin_site.name,),
                                 None, (quote(obj.pk),))
         except NoReverseMatch:
             # Change url doesn't exist -- don't display link to edit
-            return no_edit_link
+            return 'Inventory: %s' % (obj,)
 
         # Display a link to the admin page.
         return format_html('Inventory: <a href="{}">{}</a>',
                            admin_url,
                            obj)
 
-    to_sync = collector.nested(format_callback)
+    sample = [format_callback(obj) for obj in queryset[:_CONFIRMATION_SAMPLE_SIZE]]
+    return sample, queryset.count()
+
+
+def _selection_confirmation(modeladmin, request, queryset, template, title, perms_needed=()):
+    with replica_reads():
+        sample, count = get_selection_summary(queryset, modeladmin.admin_site)
+    context = {
+        **modeladmin.admin_site.each_context(request),
+        'title': title,
+        'objects_name': str(model_ngettext(modeladmin.opts, count)),
+        'sample_objects': sample,
+        'count': count,
+        'remaining_count': count - len(sample),
+        'perms_lacking': perms_needed,
+        'select_across': request.POST.get('select_across') == '1',
+        'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        'opts': modeladmin.opts,
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        'media': modeladmin.media,
+    }
+    request.current_app = modeladmin.admin_site.name
+    return TemplateResponse(request, template, context)
 
-    protected = [format_callback(obj) for obj in collector.protected]
-    model_count = {'Inventory': len(objs) for model, objs in collector.model_objs.items()}
 
-    return to_sync, model_count, perms_needed, protected
+def delete_in_chunks(modeladmin, request, queryset):
+    """
+    Delete ``queryset`` one keyset-paginated chunk at a time, writing the admin
+    log entries for each chunk with a single INSERT. Return the number of
+    deleted objects.
+    """
+    content_type_id = get_content_type_for_model(modeladmin.model).pk
+    deleted = 0
+    for chunk in chunked_queryset(queryset, _DELETE_CHUNK_SIZE):
+        with write_lane(), transaction.atomic():
+            LogEntry.objects.bulk_create([LogEntry(user_id=request.user.pk,
+                                                   content_type_id=content_type_id,
+                                                   object_id=str(obj.pk),
+                                                   object_repr=str(obj)[:200],
+                                                   action_flag=DELETION) for obj in chunk])
+            Inventory.objects.filter(pk__in=[obj.pk for obj in chunk]).delete()
+            update_inventory_stats(removed=[obj.stats_snapshot() for obj in chunk])
+        deleted += len(chunk)
+    return deleted
 
 
 def _check_feed_status(modeladmin, request, select_store_template):
@@ -362,6 +477,41 @@ def _check_feed_status(modeladmin, request, select_store_template):
     return TemplateResponse(request, select_store_template, context)
 
 
+_FEED_STATUS_IMAGES = {
+    0: mark_safe('<img src="/static/admin/img/icon-no.svg" alt="Not fed" title="Not fed">'),
+    1: mark_safe('<img src="/static/admin/img/icon-yes.svg" alt="Fed" title="Fed">'),
+    2: mark_safe('<img src="/static/admin/img/icon-alert.svg" alt="Awaiting check feed status" '
+                 'title="Awaiting check feed status">'),
+}
+
+
+class InventoryChangeList(ChangeList):
+    """
+    Inventory changelist whose "Next" link carries the last primary key of the
+    page as a cursor, letting ``SeekPaginator`` read the next page straight
+    from the index.
+    """
+    next_page_url = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        return super().get_query_string(new_params, (remove or []) + [CURSOR_VAR])
+
+    def get_results(self, request):
+        super().get_results(request)
+        if self.paginator.count_is_estimate:
+            has_next = len(self.result_list) == self.list_per_page
+        else:
+            has_next = self.page_num + 1 < self.paginator.num_pages
+        if isinstance(self.result_list, list) and self.result_list and has_next:
+            self.next_page_url = self.get_query_string({PAGE_VAR: self.page_num + 1,
+                                                        CURSOR_VAR: self.result_list[-1].pk})
+
+
 class InventoryAdmin(admin.ModelAdmin):
     add_form = InventoryCreationForm
     change_form = InventoryChangeForm
@@ -389,22 +539,12 @@ class InventoryAdmin(admin.ModelAdmin):
     action_form = ActionForm
     actions = ['custom_delete_selected', 'sync_inventory', 'check_sync_status']
     list_per_page = 1000
+    list_select_related = ('store',)
+    show_full_result_count = False
+    search_fields = ('sku', 'upc', 'sku_vendor', 'asin', 'item_name')
 
     def feed_status_image(self, i):
-        switcher = {
-            0: lambda: mark_safe(
-                '<img src="/static/admin/img/icon-no.svg" alt="Not fed" title="Not fed">'
-            ),
-            1: lambda: mark_safe(
-                '<img src="/static/admin/img/icon-yes.svg" alt="Fed" title="Fed">'
-            ),
-            2: lambda: mark_safe(
-                '<img src="/static/admin/img/icon-alert.svg" alt="Awaiting check feed status" '
-                'title="Awaiting check feed status">'
-            ),
-        }
-        func = switcher.get(i, lambda: 'Invalid')
-        return func()
+        return _FEED_STATUS_IMAGES.get(i, 'Invalid')
 
     def _feed_status(self, obj):
         return self.feed_status_image(obj.sync_status)
@@ -425,9 +565,15 @@ class InventoryAdmin(admin.ModelAdmin):
                 logger.error(e)
                 self.message_user(request, 'Amazon was unable to process your action, please check the logs for more '
                                            'details.', messages.ERROR)
-            delete_selected_(self, request, queryset)
+            n = delete_in_chunks(self, request, queryset)
+            if n:
+                self.message_user(request, 'Successfully deleted %(count)d %(items)s.' % {
+                    "count": n, "items": model_ngettext(self.opts, n)
+                }, messages.SUCCESS)
             return None
-        return delete_selected_(self, request, queryset)
+        return _selection_confirmation(self, request, queryset,
+                                       'admin/store/inventory/delete_selected_confirmation.html',
+                                       'Are you sure?')
 
     custom_delete_selected.short_description = 'Delete selected objects'
 
@@ -441,25 +587,10 @@ class InventoryAdmin(admin.ModelAdmin):
         if request.POST.get('post'):
             update_aws(self, request, queryset, 'update')
             return None
-        syncable_objects, model_count, perms_needed, protected = get_synced_objects(self, queryset, request,
-                                                                                    self.admin_site)
-
-        objects_name = model_ngettext(queryset)
-
-        context = {
-            **self.admin_site.each_context(request),
-            'title': 'Are you sure?',
-            'objects_name': str(objects_name),
-            'syncable_objects': [syncable_objects],
-            'model_count': dict(model_count).items(),
-            'queryset': queryset,
-            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
-            'media': self.media,
-        }
-
-        request.current_app = self.admin_site.name
-
-        return TemplateResponse(request, "admin/store/inventory/sync_selected_confirmation.html", context)
+        perms_needed = () if self.has_sync_permission(request) else ('Inventory',)
+        return _selection_confirmation(self, request, queryset,
+                                       'admin/store/inventory/sync_selected_confirmation.html',
+                                       'Are you sure?', perms_needed)
 
     sync_inventory.short_description = "Feed Inventory -> Marketplace"
     sync_inventory.allowed_permissions = ('sync',)
@@ -512,6 +643,45 @@ class InventoryAdmin(admin.ModelAdmin):
                 qs = qs.filter(store_id=None)
         return qs
 
+    def get_changelist(self, request, **kwargs):
+        return InventoryChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return search_inventory(queryset, search_term), False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            cursor = int(request.GET.get(PAGE_VAR, 0)) + 1, uuid.UUID(request.GET[CURSOR_VAR])
+        except (KeyError, ValueError):
+            cursor = None
+        return SeekPaginator(queryset, per_page, orphans, allow_empty_first_page, cursor=cursor,
+                             count_limit=settings.ADMIN_EXACT_COUNT_LIMIT, known_count=self._stored_count(request))
+
+    def _stored_count(self, request):
+        """
+        The changelist's item count from the InventoryStats totals when it
+        lists a whole store (or every store) unfiltered and unsearched; None
+        when the rows have to be counted.
+        """
+        filters = {name: value for name, value in request.GET.items()
+                   if name not in IGNORED_PARAMS + (PAGE_VAR, CURSOR_VAR)}
+        if request.GET.get(SEARCH_VAR, '').strip():
+            return None
+        if not request.user.is_superuser:
+            if filters or not request.user.store:
+                return None
+            return stored_inventory_count(request.user.store.id)
+        store_id = filters.pop('store__id__exact', None)
+        if filters:
+            return None
+        try:
+            return stored_inventory_count(uuid.UUID(store_id) if store_id is not None else None)
+        except ValueError:
+            return None
+
     def get_list_display(self, request):
         my_list_display = super(InventoryAdmin, self).get_list_display(request)
         if request.user.is_superuser:
@@ -546,6 +716,90 @@ class InventoryAdmin(admin.ModelAdmin):
 admin.site.register(Inventory, InventoryAdmin)
 
 
+class InventoryChangeAdmin(admin.ModelAdmin):
+    list_display = ('sku', 'csv_update_number', 'created', '_changes', 'date', 'store')
+    list_filter = ('csv_update_number',)
+    search_fields = ('=sku',)
+    list_select_related = ('store',)
+    actions = ['rollback_import']
+
+    def _changes(self, obj):
+        return ', '.join('%s: %s -> %s' % (Inventory._meta.get_field(name).verbose_name, old, new)
+                         for name, (old, new) in sorted(obj.changed_values().items()))
+
+    _changes.short_description = 'Changes'
+
+    def rollback_import(self, request, queryset):
+        targets = list(queryset.values('store').annotate(first_update=Min('csv_update_number')).order_by())
+        if len(targets) != 1:
+            self.message_user(request, 'Select changes of a single store to roll back.', messages.WARNING)
+            return None
+        store = Store.objects.get(pk=targets[0]['store'])
+        csv_update_number = targets[0]['first_update'] - 1
+        if request.POST.get('post'):
+            restored = rollback_store(store, csv_update_number)
+            self.message_user(request, '%(store)s: restored %(count)d %(items)s to update %(number)d.' % {
+                'store': store, 'count': restored, 'items': model_ngettext(Inventory._meta, restored),
+                'number': csv_update_number
+            }, messages.SUCCESS)
+            if restored:
+                report_sync_results(self, request, sync_pending_stores([store]))
+            return None
+        with replica_reads():
+            states = inventory_as_of(store, csv_update_number)
+        skus = sorted(sku for sku, state in states.items() if state)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Are you sure?',
+            'store': store,
+            'csv_update_number': csv_update_number,
+            'sample_skus': skus[:_CONFIRMATION_SAMPLE_SIZE],
+            'count': len(skus),
+            'remaining_count': max(len(skus) - _CONFIRMATION_SAMPLE_SIZE, 0),
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across') == '1',
+            'opts': self.opts,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'media': self.media,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/store/inventorychange/rollback_confirmation.html', context)
+
+    rollback_import.short_description = 'Roll back the selected imports and feed the previous state'
+    rollback_import.allowed_permissions = ('sync',)
+
+    def has_sync_permission(self, request, obj=None):
+        if request.user.is_superuser or request.user.store:
+            return request.user.has_perm('store.sync_inventory')
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_view_permission(self, request, obj=None):
+        if request.user.is_superuser or request.user.store:
+            return super(InventoryChangeAdmin, self).has_view_permission(request, obj)
+        return False
+
+    def get_queryset(self, request):
+        qs = super(InventoryChangeAdmin, self).get_queryset(request)
+        if not request.user.is_superuser:
+            if request.user.store:
+                qs = qs.filter(store=request.user.store)
+            else:
+                qs = qs.filter(id=None)
+        return qs
+
+
+admin.site.register(InventoryChange, InventoryChangeAdmin)
+
+
 class FeedSubmissionInfoAdmin(admin.ModelAdmin):
     list_display = ('feed_submission_id',
                     'feed_type',
@@ -569,6 +823,7 @@ class FeedSubmissionInfoAdmin(admin.ModelAdmin):
         }),
     )
     list_filter = ('feed_processing_status',)
+    list_select_related = ('store',)
 
     actions = ['check_sync_status', 'view_feed_items']
 
@@ -621,25 +876,82 @@ class FeedSubmissionInfoAdmin(admin.ModelAdmin):
     check_sync_status.short_description = "Check Feed Status"
 
     def view_feed_items(self, request, queryset):
+        return HttpResponseRedirect(reverse('admin:store_feedsubmissioninfo_items', args=(quote(queryset[0].pk),),
+                                            current_app=self.admin_site.name))
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/items/', self.admin_site.admin_view(self.feed_items_view),
+                 name='store_feedsubmissioninfo_items'),
+            path('<path:object_id>/items/csv/', self.admin_site.admin_view(self.feed_items_csv_view),
+                 name='store_feedsubmissioninfo_items_csv'),
+        ] + super().get_urls()
+
+    def _get_feed_items(self, request, object_id):
+        feed_submission_info = self.get_object(request, unquote(object_id))
+        if feed_submission_info is None:
+            raise Http404('Feed Submission Info with ID "%s" doesn\'t exist.' % object_id)
+        if not self.has_view_permission(request, feed_submission_info):
+            raise PermissionDenied
+        items = feed_submission_info.inventory_set.all()
+        if request.GET.get('q'):
+            items = items.filter(sku__startswith=request.GET['q'])
+        if request.GET.get('sync_status') in ('0', '1', '2'):
+            items = items.filter(sync_status=int(request.GET['sync_status']))
+        return feed_submission_info, items
+
+    def feed_items_view(self, request, object_id):
+        feed_submission_info, items = self._get_feed_items(request, object_id)
+        try:
+            page_number = int(request.GET.get(PAGE_VAR, 1))
+        except ValueError:
+            page_number = 1
+        try:
+            cursor = page_number, uuid.UUID(request.GET[CURSOR_VAR])
+        except (KeyError, ValueError):
+            cursor = None
+        paginator = SeekPaginator(items.order_by('pk'), _FEED_ITEMS_PER_PAGE, cursor=cursor)
+        try:
+            page = paginator.page(page_number)
+        except InvalidPage:
+            page = paginator.page(1)
+        query = request.GET.copy()
+        query.pop(PAGE_VAR, None)
+        query.pop(CURSOR_VAR, None)
         context = {
             **self.admin_site.each_context(request),
             'title': 'Inventory Items',
-            'feedSubmissionInfo': queryset[0],
-            'items': queryset[0].inventory_set.all(),
+            'feedSubmissionInfo': feed_submission_info,
+            'page': page,
+            'items': page.object_list,
+            'next_cursor': page.object_list[-1].pk if page.has_next() else None,
+            'query': query.urlencode(),
+            'q': request.GET.get('q', ''),
+            'sync_status': request.GET.get('sync_status', ''),
+            'sync_status_choices': Inventory.SYNC_STATUS_CHOICES,
             'media': self.media,
         }
         request.current_app = self.admin_site.name
         return TemplateResponse(request, 'admin/store/feedsubmissioninfo/inventory_items.html', context)
 
+    def feed_items_csv_view(self, request, object_id):
+        feed_submission_info, items = self._get_feed_items(request, object_id)
+        sync_statuses = dict(Inventory.SYNC_STATUS_CHOICES)
+        rows = ((sku, upc, asin, item_name, sku_vendor, standard_price, quantity, mws_normalize_condition(condition),
+                 handling_time, sync_statuses.get(sync_status))
+                for sku, upc, asin, item_name, sku_vendor, standard_price, quantity, condition, handling_time, sync_status
+                in items.values_list('sku', 'upc', 'asin', 'item_name', 'sku_vendor', 'standard_price', 'quantity',
+                                     'condition', 'handling_time', 'sync_status').iterator(chunk_size=2000))
+        return streaming_csv_response('feed_%s_items.csv' % feed_submission_info.feed_submission_id,
+                                      ['SKU', 'UPC', 'ASIN', 'Item Name', 'SKU Vendor', 'Standard Price', 'Quantity',
+                                       'Condition', 'Handling Time', 'Sync Status'],
+                                      rows)
+
     def _feed_items(self, obj):
-        return mark_safe(
-            '<a href="javascript: void(0)" onclick="django.jQuery(\'%s\')[0].value = \'%s\'; '
-            'django.jQuery(\'%s\').attr({type: \'%s\', name: \'%s\', value: \'%s\'}).appendTo(\'%s\'); '
-            'django.jQuery(\'%s\')[0].submit();" '
-            'class="viewlink"></a>&nbsp;&nbsp;(%s)' %
-            ('#feedsubmissioninfo-form-action', 'view_feed_items', '<input>', 'hidden', '_selected_action', obj.pk,
-             '#changelist-form', '#changelist-form', obj.inventory_set.count())
-        )
+        return format_html('<a href="{}" class="viewlink"></a>&nbsp;&nbsp;({})',
+                           reverse('admin:store_feedsubmissioninfo_items', args=(quote(obj.pk),),
+                                   current_app=self.admin_site.name),
+                           obj.item_count)
     _feed_items.short_description = 'Feed Items'
 
     def has_add_permission(self, request):
@@ -669,3 +981,114 @@ class FeedSubmissionInfoAdmin(admin.ModelAdmin):
 
 
 admin.site.register(FeedSubmissionInfo, FeedSubmissionInfoAdmin)
+
+
+class FeedSubmissionArchiveAdmin(admin.ModelAdmin):
+    list_display = ('feed_submission_id',
+                    'feed_type',
+                    'feed_processing_status',
+                    'item_count',
+                    'submitted_date',
+                    'completed_processing_date',
+                    'archived_date',
+                    'store',)
+    list_filter = ('feed_type', 'feed_processing_status')
+    search_fields = ('=feed_submission_id',)
+    list_select_related = ('store',)
+    date_hierarchy = 'submitted_date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_view_permission(self, request, obj=None):
+        if request.user.is_superuser or request.user.store:
+            return super(FeedSubmissionArchiveAdmin, self).has_view_permission(request, obj)
+        return False
+
+    def get_queryset(self, request):
+        qs = super(FeedSubmissionArchiveAdmin, self).get_queryset(request)
+        if not request.user.is_superuser:
+            if request.user.store:
+                qs = qs.filter(store=request.user.store)
+            else:
+                qs = qs.filter(id=None)
+        return qs
+
+
+admin.site.register(FeedSubmissionArchive, FeedSubmissionArchiveAdmin)
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('date', 'method', 'path', 'view_name', 'username', 'status_code', 'duration', 'query_count',
+                    'query_duration', 'sample_count', '_stacks')
+    list_filter = ('view_name',)
+    exclude = ('collapsed_stacks', 'queries')
+    readonly_fields = ('_queries',)
+
+    def _stacks(self, obj):
+        return format_html('<a href="{}">collapsed.txt</a>',
+                           reverse('admin:store_requestprofile_stacks', args=(quote(obj.pk),),
+                                   current_app=self.admin_site.name))
+
+    _stacks.short_description = 'Stacks'
+
+    def _queries(self, obj):
+        return format_html_join('', '<p>{} ms &middot; {}<br><code>{}</code><br><small>{}</small></p>',
+                                (('%.2f' % (query['seconds'] * 1000), query['alias'], query['sql'], query['params'])
+                                 for query in json.loads(obj.queries)))
+
+    _queries.short_description = 'SQL'
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/stacks/', self.admin_site.admin_view(self.stacks_view),
+                 name='store_requestprofile_stacks'),
+        ] + super(RequestProfileAdmin, self).get_urls()
+
+    def stacks_view(self, request, object_id):
+        profile = self.get_object(request, unquote(object_id))
+        if profile is None:
+            raise Http404('Request Profile with ID "%s" doesn\'t exist.' % object_id)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        response = HttpResponse(profile.collapsed_stacks, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="profile_%s.collapsed.txt"' % profile.pk
+        return response
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+
+admin.site.register(RequestProfile, RequestProfileAdmin)
+
+
+class MwsCallAdmin(admin.ModelAdmin):
+    list_display = ('date', 'operation', 'seller_id', 'outcome', 'status_code', 'duration', 'request_bytes',
+                    'response_bytes', 'quota_remaining', 'quota_max', 'quota_resets_on')
+    list_filter = ('operation', 'outcome')
+    search_fields = ('=seller_id', '=request_id')
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+
+admin.site.register(MwsCall, MwsCallAdmin)
@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+from utils.db import configure_sqlite
+
+
+def ensure_search_index(sender, using, **kwargs):
+    from store.search import ensure_search_index
+    ensure_search_index(connections[using])
 
 
 class StoreConfig(AppConfig):
     name = 'store'
+
+    def ready(self):
+        post_migrate.connect(ensure_search_index, sender=self)
+        connection_created.connect(configure_sqlite)
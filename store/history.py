@@ -0,0 +1,56 @@
+from django.db import transaction
+
+from store.models import Inventory, InventoryChange, inventory_change, next_csv_update_number
+from utils.db import write_lane
+
+_BATCH_SIZE = 500
+
+
+def inventory_as_of(store, csv_update_number, skus=None):
+    """
+    The state of ``store``'s inventory right after import ``csv_update_number``,
+    for the SKUs changed since: ``{sku: {field: value}}`` with only the fields
+    that differ from today, or ``{sku: None}`` for SKUs that did not exist
+    yet. Only the changes made after that import are read.
+    """
+    changes = InventoryChange.objects.filter(store=store, csv_update_number__gt=csv_update_number)
+    if skus is not None:
+        changes = changes.filter(sku__in=skus)
+    states = {}
+    for change in changes.order_by('-csv_update_number', '-id').iterator():
+        if change.created:
+            states[change.sku] = None
+            continue
+        state = states.get(change.sku) or {}
+        state.update((name, old) for name, (old, new) in change.changed_values().items())
+        states[change.sku] = state
+    return states
+
+
+def rollback_store(store, csv_update_number):
+    """
+    Put every item of ``store`` changed after import ``csv_update_number`` back
+    to its state at that import, recording the rollback as a new update
+    number. Items that did not exist then, or no longer exist, are left
+    alone. Restored items whose feed fields changed are pending a feed again.
+    Return the number of restored items.
+    """
+    states = {sku: state for sku, state in inventory_as_of(store, csv_update_number).items() if state}
+    number = next_csv_update_number(store.pk)
+    skus = sorted(states)
+    restored = 0
+    for start in range(0, len(skus), _BATCH_SIZE):
+        changes = []
+        with write_lane(), transaction.atomic():
+            for inventory in Inventory.objects.filter(store=store, sku__in=skus[start:start + _BATCH_SIZE]):
+                for name, value in states[inventory.sku].items():
+                    setattr(inventory, name, value)
+                change = inventory_change(inventory, number)
+                if change is None:
+                    continue
+                inventory.csv_update_number = number
+                inventory.save()
+                changes.append(change)
+            InventoryChange.objects.bulk_create(changes)
+        restored += len(changes)
+    return restored
@@ -0,0 +1,274 @@
+import csv
+import gzip
+import logging
+import uuid
+from functools import partial
+
+from django.db import connection, transaction, models
+from mws import MWSError
+
+from store.models import Inventory, InventoryChange, CSV_COLUMNS, inventory_change, update_inventory_stats
+from utils import aws
+from utils.csv_export import Echo
+from utils.db import write_lane, after_write_lane
+from utils.helper import normalize_condition
+
+logger = logging.getLogger(__name__)
+
+_BATCH_SIZE = 500
+# GetMatchingProductForId accepts at most five ids per request.
+_PRODUCT_LOOKUP_SIZE = 5
+_UPLOAD_FIELDS = ('csv_filename', 'csv_datetime', 'csv_update_number')
+
+
+def import_inventory(store, path, filename):
+    """
+    Merge the inventory CSV file at ``path``, uploaded as ``filename`` and
+    possibly gzip-compressed, into ``store``'s Inventory as upload
+    ``store.csv_update_number``, recording history and stats, then, once
+    committed, look up ASIN and title of the new items. PostgreSQL merges through COPY
+    and one set-based upsert, other databases through batched bulk writes.
+    """
+    upload = {
+        'csv_filename': filename,
+        'csv_datetime': store.csv_datetime,
+        'csv_update_number': store.csv_update_number,
+    }
+    merge = _copy_merge if connection.vendor == 'postgresql' else _batched_merge
+    with write_lane():
+        upcs = merge(store, read_rows(path), upload)
+    # The MWS lookups wait for the import to commit and leave the write lane: no I/O under the write lock.
+    transaction.on_commit(lambda: after_write_lane(partial(lookup_products, store, upcs)))
+
+
+def read_rows(path):
+    """Yield the rows of an inventory CSV file as ``{field: value}``, typed like the Inventory fields."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as csv_file:
+        rows = csv.reader(csv_file)
+        next(rows, None)
+        for columns in rows:
+            if columns:
+                yield parse_row(columns)
+
+
+def parse_row(columns):
+    values = {}
+    for name, value in zip(CSV_COLUMNS, columns):
+        if name == 'condition':
+            value = normalize_condition(value)
+        values[name] = Inventory._meta.get_field(name).to_python(value)
+    return values
+
+
+def _batched_merge(store, rows, upload):
+    """
+    Merge ``rows`` ``_BATCH_SIZE`` SKUs at a time: one query reads the existing
+    items of a batch, then bulk INSERT/UPDATE statements write it in a single
+    transaction. Return the UPCs that need a product lookup.
+    """
+    upcs = set()
+    batch = {}
+    for row in rows:
+        batch[row['sku']] = row
+        if len(batch) >= _BATCH_SIZE:
+            upcs.update(_merge_batch(store, batch, upload))
+            batch = {}
+    if batch:
+        upcs.update(_merge_batch(store, batch, upload))
+    return upcs
+
+
+def _merge_batch(store, batch, upload):
+    """
+    Write the items of ``batch`` that are new or differ from their stored row,
+    stamped with the upload; unchanged items are not written and keep the
+    stamp of the upload that last changed them.
+    """
+    upcs = []
+    created, updated, changes, removed, added = [], [], [], [], []
+    fields = set(_UPLOAD_FIELDS)
+    with transaction.atomic():
+        existing = {item.sku: item for item in Inventory.objects.filter(store=store, sku__in=list(batch))}
+        for sku, values in batch.items():
+            item = existing.get(sku)
+            if item is None:
+                item = Inventory(store=store, sku=sku)
+            if item.upc != values['upc']:
+                upcs.append(values['upc'])
+            for name, value in values.items():
+                setattr(item, name, value)
+            if item._state.adding:
+                created.append(item)
+            else:
+                changed = item.changed_fields()
+                if not changed:
+                    continue
+                if any(name in changed for name in Inventory.FEED_FIELDS):
+                    item.sync_status = 0
+                    changed.append('sync_status')
+                fields.update(changed)
+                removed.append(item.stats_snapshot(loaded=True))
+                updated.append(item)
+            for name, value in upload.items():
+                setattr(item, name, value)
+            change = inventory_change(item, upload['csv_update_number'])
+            if change is not None:
+                changes.append(change)
+            added.append(item.stats_snapshot())
+        Inventory.objects.bulk_create(created)
+        if updated:
+            Inventory.objects.bulk_update(updated, sorted(fields))
+        InventoryChange.objects.bulk_create(changes)
+        update_inventory_stats(removed, added)
+    return upcs
+
+
+class _CsvStream(object):
+    """File-like object serving ``rows`` as CSV text to ``COPY ... FROM STDIN``, a few rows at a time."""
+    def __init__(self, rows):
+        self._rows = rows
+        self._writer = csv.writer(Echo(), quoting=csv.QUOTE_NONNUMERIC)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                chunk = self._writer.writerow(next(self._rows))
+            except StopIteration:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _copy_merge(store, rows, upload):
+    """
+    COPY ``rows`` into a temporary staging table and merge it into
+    store_inventory with set-based statements: the history rows, the stats
+    deltas and a single INSERT ... ON CONFLICT (store_id, sku) DO UPDATE that
+    also resets sync_status where a feed field changed and skips the rows
+    the file does not change, which keep their upload stamp. Return the UPCs
+    that need a product lookup.
+    """
+    fields = [Inventory._meta.get_field(name) for name in CSV_COLUMNS]
+    staged = ['line', 'id'] + [field.column for field in fields]
+    csv_columns = [field.column for field in fields if field.name != 'sku']
+    params = dict(upload, store=str(store.pk))
+
+    def changed(column):
+        field = Inventory._meta.get_field(column)
+        value = '%s::text' if isinstance(field, models.DecimalField) else '%s'
+        return ("'%(column)s', CASE WHEN i.%(column)s IS DISTINCT FROM s.%(column)s "
+                "THEN jsonb_build_array(%(old)s, %(new)s) END" % {
+                    'column': column, 'old': value % ('i.' + column), 'new': value % ('s.' + column)})
+
+    def stats_delta(sign):
+        return ("INSERT INTO inventory_stats_delta (sync_status, condition, items, stock_value) "
+                "SELECT i.sync_status, i.condition, %(sign)s count(*), %(sign)s coalesce(sum(i.cost_price * i.quantity), 0) "
+                "FROM store_inventory i JOIN inventory_staging s ON i.store_id = %%(store)s AND i.sku = s.sku "
+                "GROUP BY i.sync_status, i.condition" % {'sign': sign})
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE inventory_staging (line integer, id uuid, %s) ON COMMIT DROP' % ', '.join(
+            '%s %s' % (field.column, field.db_type(connection)) for field in fields))
+        cursor.copy_expert('COPY inventory_staging (%s) FROM STDIN WITH (FORMAT csv)' % ', '.join(staged),
+                           _CsvStream([line, uuid.uuid4().hex] + [row[name] for name in CSV_COLUMNS]
+                                      for line, row in enumerate(rows)))
+        # The last line of a SKU wins, as if the file were applied row by row.
+        cursor.execute('DELETE FROM inventory_staging s USING inventory_staging t WHERE s.sku = t.sku AND s.line < t.line')
+        cursor.execute('CREATE INDEX ON inventory_staging (sku)')
+        cursor.execute('ANALYZE inventory_staging')
+
+        cursor.execute('SELECT DISTINCT s.upc FROM inventory_staging s LEFT JOIN store_inventory i '
+                       'ON i.store_id = %(store)s AND i.sku = s.sku WHERE i.upc IS DISTINCT FROM s.upc', params)
+        upcs = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("INSERT INTO store_inventorychange (store_id, sku, csv_update_number, created, changes, date) "
+                       "SELECT %%(store)s, sku, %%(csv_update_number)s, created, changes::text, now() FROM ("
+                       "SELECT s.sku, i.id IS NULL AS created, jsonb_strip_nulls(jsonb_build_object(%s)) AS changes "
+                       "FROM inventory_staging s LEFT JOIN store_inventory i ON i.store_id = %%(store)s AND i.sku = s.sku"
+                       ") c WHERE changes <> '{}'::jsonb" % ', '.join(changed(column) for column in csv_columns), params)
+
+        cursor.execute('CREATE TEMPORARY TABLE inventory_stats_delta (sync_status smallint, condition varchar(200), '
+                       'items bigint, stock_value numeric) ON COMMIT DROP')
+        cursor.execute(stats_delta('-'), params)
+
+        cursor.execute(
+            "INSERT INTO store_inventory AS i (id, store_id, sku, %(columns)s, sync_status, create_date, %(upload)s) "
+            "SELECT s.id, %%(store)s, s.sku, %(staged)s, 0, CURRENT_DATE, %(upload_params)s FROM inventory_staging s "
+            "ON CONFLICT (store_id, sku) DO UPDATE SET %(updates)s, "
+            "sync_status = CASE WHEN (%(old_feed)s) IS DISTINCT FROM (%(new_feed)s) THEN 0 ELSE i.sync_status END "
+            "WHERE (%(old_csv)s) IS DISTINCT FROM (%(new_csv)s)" % {
+                'columns': ', '.join(csv_columns),
+                'upload': ', '.join(_UPLOAD_FIELDS),
+                'staged': ', '.join('s.%s' % column for column in csv_columns),
+                'upload_params': ', '.join('%%(%s)s' % name for name in _UPLOAD_FIELDS),
+                'updates': ', '.join('%s = EXCLUDED.%s' % (column, column) for column in csv_columns + list(_UPLOAD_FIELDS)),
+                'old_feed': ', '.join('i.%s' % column for column in Inventory.FEED_FIELDS),
+                'new_feed': ', '.join('EXCLUDED.%s' % column for column in Inventory.FEED_FIELDS),
+                'old_csv': ', '.join('i.%s' % column for column in csv_columns),
+                'new_csv': ', '.join('EXCLUDED.%s' % column for column in csv_columns),
+            }, params)
+
+        cursor.execute(stats_delta('+'), params)
+        cursor.execute(
+            "INSERT INTO store_inventorystats AS t (store_id, sync_status, condition, items, stock_value) "
+            "SELECT %(store)s, sync_status, condition, sum(items), sum(stock_value) FROM inventory_stats_delta "
+            "GROUP BY sync_status, condition "
+            "ON CONFLICT (store_id, sync_status, condition) DO UPDATE "
+            "SET items = t.items + EXCLUDED.items, stock_value = t.stock_value + EXCLUDED.stock_value", params)
+        # ON COMMIT DROP only fires with the outermost transaction, which may run further imports.
+        cursor.execute('DROP TABLE inventory_staging, inventory_stats_delta')
+    return upcs
+
+
+def lookup_products(store, upcs):
+    """Fill in the ASIN and title of ``store``'s items with the given UPCs, five UPCs per MWS request."""
+    upcs = sorted(set(upcs))
+    for start in range(0, len(upcs), _PRODUCT_LOOKUP_SIZE):
+        try:
+            products = aws.get_items(store.seller_id, store.auth_token, upcs[start:start + _PRODUCT_LOOKUP_SIZE])
+        except MWSError as e:
+            logger.error(e)
+            continue
+        except aws.ThrottlingException as e:
+            # The quota is used up for longer than pacing waits: the remaining items keep no ASIN/title.
+            logger.error(e)
+            break
+        results = products.parsed or []
+        if not isinstance(results, list):
+            results = [results]
+        details = {result['Id']['value']: product_details(result) for result in results}
+        items = []
+        for item in Inventory.objects.filter(store=store, upc__in=list(details)).only('pk', 'upc', 'asin', 'item_name'):
+            asin, title = details[item.upc]
+            item.asin = item.asin if asin is None else asin
+            item.item_name = item.item_name if title is None else title
+            items.append(item)
+        Inventory.objects.bulk_update(items, ['asin', 'item_name'])
+
+
+def product_details(result):
+    """ASIN and title from one GetMatchingProductForId result; None for what it lacks."""
+    asin = title = None
+    if result['status'] and result['status']['value'] == 'ClientError':
+        logger.error(result['Error']['Message']['value'])
+    elif result['Products'] and result['Products']['Product']:
+        product_parsed = result['Products']['Product']
+        if isinstance(product_parsed, list):
+            product_parsed = product_parsed[0]
+        if product_parsed['Identifiers'] and product_parsed['Identifiers']['MarketplaceASIN'] and \
+                product_parsed['Identifiers']['MarketplaceASIN']['ASIN']:
+            asin = product_parsed['Identifiers']['MarketplaceASIN']['ASIN']['value']
+        if product_parsed['AttributeSets'] and product_parsed['AttributeSets']['ItemAttributes'] and \
+                product_parsed['AttributeSets']['ItemAttributes']['Title']:
+            title = product_parsed['AttributeSets']['ItemAttributes']['Title']['value']
+    return asin, title
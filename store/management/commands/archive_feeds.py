@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.retention import archive_feeds
+
+
+class Command(BaseCommand):
+    help = 'Move completed feeds older than the retention period, and their item links, to the feed archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.FEED_RETENTION_DAYS,
+                            help='Keep feeds submitted in the last DAYS days (default: FEED_RETENTION_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=settings.FEED_RETENTION_BATCH_SIZE,
+                            help='Feeds archived per batch (default: FEED_RETENTION_BATCH_SIZE).')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches, to leave room for other writers.')
+
+    def handle(self, *args, **options):
+        archived, unlinked = archive_feeds(options['days'], options['batch_size'], options['pause'])
+        self.stdout.write('Archived %(feeds)d feeds and removed %(links)d item links.' % {
+            'feeds': archived, 'links': unlinked
+        })
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from utils import archive
+
+
+class Command(BaseCommand):
+    help = 'Remove archived feed bodies and processing reports older than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_RETENTION_DAYS,
+                            help='Retention period in days (default: ARCHIVE_RETENTION_DAYS).')
+
+    def handle(self, *args, **options):
+        removed_entries, removed_objects = archive.prune(options['days'])
+        self.stdout.write('Removed %(entries)d archive entries and %(objects)d objects.' % {
+            'entries': removed_entries, 'objects': removed_objects
+        })
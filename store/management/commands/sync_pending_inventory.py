@@ -0,0 +1,48 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import Store
+from store.sync import sync_pending_stores, stores_with_pending_items
+
+
+class Command(BaseCommand):
+    help = 'Feed every inventory item changed since it was last fed to the Amazon Marketplace, store by store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', action='append', dest='stores', default=[],
+                            help='Store ID to feed (repeatable). Defaults to every store with pending items.')
+        parser.add_argument('--chunk-size', type=int, default=settings.SYNC_CHUNK_SIZE,
+                            help='Items per submitted feed (default: SYNC_CHUNK_SIZE).')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, feeding pending items every INTERVAL seconds. '
+                                 'Without it the command runs once, e.g. from cron.')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sync(options['stores'], options['chunk_size'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self, store_ids, chunk_size):
+        if store_ids:
+            for store_id in store_ids:
+                try:
+                    uuid.UUID(store_id)
+                except ValueError:
+                    raise CommandError('%s is not a store ID' % store_id)
+            stores = list(Store.objects.filter(id__in=store_ids))
+            if len(stores) != len(set(store_ids)):
+                raise CommandError('Unknown store in %s' % ', '.join(store_ids))
+        else:
+            stores = list(stores_with_pending_items())
+        for result in sync_pending_stores(stores, chunk_size):
+            if result.error is not None:
+                self.stderr.write('%(store)s: %(error)s (%(count)d items fed before the failure)' % {
+                    'store': result.store, 'error': result.error, 'count': result.count
+                })
+            else:
+                self.stdout.write('%(store)s: fed %(count)d items' % {'store': result.store, 'count': result.count})
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_auto_20191016_1000'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['store', 'sync_status'], name='inventory_store_sync_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_inventory_store_sync_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['store', 'id'], name='inventory_store_id_idx'),
+        ),
+    ]
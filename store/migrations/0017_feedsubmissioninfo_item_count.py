@@ -0,0 +1,29 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:37
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_feed_items(apps, schema_editor):
+    FeedSubmissionInfo = apps.get_model('store', 'FeedSubmissionInfo')
+    feed_infos = []
+    for feed_info in FeedSubmissionInfo.objects.annotate(linked_items=Count('inventory')).iterator():
+        feed_info.item_count = feed_info.linked_items
+        feed_infos.append(feed_info)
+    FeedSubmissionInfo.objects.bulk_update(feed_infos, ['item_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_inventory_store_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedsubmissioninfo',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Feed Items'),
+        ),
+        migrations.RunPython(count_feed_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_feedsubmissioninfo_item_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feedsubmissioninfo',
+            index=models.Index(fields=['feed_submission_id'], name='feed_submission_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedsubmissioninfo',
+            index=models.Index(fields=['store', 'feed_processing_status'], name='feed_store_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['store', 'csv_update_number'], name='inventory_store_update_idx'),
+        ),
+    ]
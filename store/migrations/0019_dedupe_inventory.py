@@ -0,0 +1,39 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:38
+
+from django.db import migrations
+from django.db.models import Count, F
+
+
+def dedupe_inventory(apps, schema_editor):
+    """
+    Keep a single Inventory row per (store, sku) before the unique constraint
+    is added: the one from the most recent upload. Feed links of the dropped
+    rows are moved to the kept one.
+    """
+    Inventory = apps.get_model('store', 'Inventory')
+    Through = Inventory.feed_submission_info.through
+    duplicates = Inventory.objects.exclude(store=None).values('store', 'sku').annotate(
+        rows=Count('id')).filter(rows__gt=1).order_by()
+    for duplicate in duplicates.iterator():
+        ids = list(Inventory.objects.filter(store=duplicate['store'], sku=duplicate['sku']).order_by(
+            F('csv_update_number').desc(nulls_last=True), '-create_date').values_list('id', flat=True))
+        keep_id, drop_ids = ids[0], ids[1:]
+        linked = set(Through.objects.filter(inventory_id=keep_id).values_list('feedsubmissioninfo_id', flat=True))
+        Through.objects.bulk_create([Through(inventory_id=keep_id, feedsubmissioninfo_id=feed_id)
+                                     for feed_id in set(Through.objects.filter(inventory_id__in=drop_ids)
+                                                        .values_list('feedsubmissioninfo_id', flat=True))
+                                     if feed_id not in linked])
+        Inventory.objects.filter(id__in=drop_ids).delete()
+
+
+class Migration(migrations.Migration):
+    # On PostgreSQL the deletes leave deferred foreign key checks pending until the commit, and no ALTER TABLE
+    # of store_inventory may run before then: the unique constraint comes in the next migration.
+
+    dependencies = [
+        ('store', '0018_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_inventory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_dedupe_inventory'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='inventory',
+            constraint=models.UniqueConstraint(fields=('store', 'sku'), name='inventory_store_sku_uniq'),
+        ),
+    ]
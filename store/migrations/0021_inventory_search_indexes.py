@@ -0,0 +1,48 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+def create_item_name_trigram_index(apps, schema_editor):
+    # Serves item_name__icontains, which PostgreSQL runs as UPPER(item_name::text) LIKE UPPER(...).
+    # SQLite gets an FTS5 index instead, see store.search.ensure_search_index.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE INDEX inventory_item_name_trgm_idx ON store_inventory '
+                              'USING gin (UPPER(item_name::text) gin_trgm_ops)')
+
+
+def drop_item_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS inventory_item_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_inventory_store_sku_uniq'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='inventory',
+            name='asin',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True, verbose_name='ASIN'),
+        ),
+        migrations.AlterField(
+            model_name='inventory',
+            name='sku',
+            field=models.CharField(db_index=True, max_length=200, verbose_name='SKU'),
+        ),
+        migrations.AlterField(
+            model_name='inventory',
+            name='sku_vendor',
+            field=models.CharField(db_index=True, max_length=200, verbose_name='SKU Vendor'),
+        ),
+        migrations.AlterField(
+            model_name='inventory',
+            name='upc',
+            field=models.CharField(db_index=True, max_length=200, verbose_name='UPC'),
+        ),
+        migrations.RunPython(create_item_name_trigram_index, drop_item_name_trigram_index),
+    ]
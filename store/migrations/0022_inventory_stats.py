@@ -0,0 +1,47 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:46
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+import django.db.models.deletion
+
+
+def count_inventory_stats(apps, schema_editor):
+    Inventory = apps.get_model('store', 'Inventory')
+    InventoryStats = apps.get_model('store', 'InventoryStats')
+    stock_value = ExpressionWrapper(F('cost_price') * F('quantity'), output_field=DecimalField())
+    buckets = Inventory.objects.exclude(store=None).values('store', 'sync_status', 'condition').annotate(
+        items=Count('id'), stock_value=Sum(stock_value)).order_by()
+    InventoryStats.objects.bulk_create([InventoryStats(store_id=bucket['store'], sync_status=bucket['sync_status'],
+                                                       condition=bucket['condition'], items=bucket['items'],
+                                                       stock_value=bucket['stock_value'] or 0)
+                                        for bucket in buckets.iterator()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_inventory_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sync_status', models.SmallIntegerField(choices=[(0, 'Not synced'), (1, 'Synced'), (2, 'Awaiting check sync status')], verbose_name='Sync Status')),
+                ('condition', models.CharField(choices=[('new', 'New'), ('usedlikenew', 'UsedLikeNew'), ('usedverygood', 'UsedVeryGood'), ('usedgood', 'UsedGood'), ('usedacceptable', 'UsedAcceptable'), ('collectiblelikenew', 'CollectibleLikeNew'), ('collectibleverygood', 'CollectibleVeryGood'), ('collectiblegood', 'CollectibleGood'), ('collectibleacceptable', 'CollectibleAcceptable'), ('refurbished', 'Refurbished'), ('club', 'Club')], max_length=200, verbose_name='Condition')),
+                ('items', models.IntegerField(default=0, verbose_name='Items')),
+                ('stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Stock Value')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.Store')),
+            ],
+            options={
+                'verbose_name': 'Inventory Stats',
+                'verbose_name_plural': 'Inventory Stats',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='inventorystats',
+            constraint=models.UniqueConstraint(fields=('store', 'sync_status', 'condition'), name='inventory_stats_bucket_uniq'),
+        ),
+        migrations.RunPython(count_inventory_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_inventory_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(max_length=200, verbose_name='SKU')),
+                ('csv_update_number', models.BigIntegerField(verbose_name='Update Number')),
+                ('created', models.BooleanField(default=False, verbose_name='New Item')),
+                ('changes', models.TextField(verbose_name='Changes')),
+                ('date', models.DateTimeField(auto_now_add=True, verbose_name='Date Time')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.Store')),
+            ],
+            options={
+                'verbose_name': 'Inventory Change',
+                'verbose_name_plural': 'Inventory History',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventorychange',
+            index=models.Index(fields=['store', 'csv_update_number'], name='inventory_change_update_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorychange',
+            index=models.Index(fields=['store', 'sku', 'csv_update_number'], name='inventory_change_sku_idx'),
+        ),
+    ]
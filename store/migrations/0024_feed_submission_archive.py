@@ -0,0 +1,40 @@
+# Generated by Django 2.2.5 on 2026-10-19 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_inventory_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedSubmissionArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('feed_submission_id', models.CharField(max_length=200, verbose_name='Feed Submission ID')),
+                ('feed_type', models.CharField(max_length=200, verbose_name='Feed Type')),
+                ('submitted_date', models.DateTimeField(verbose_name='Submitted Date')),
+                ('feed_processing_status', models.CharField(max_length=200, verbose_name='Feed Processing Status')),
+                ('started_processing_date', models.DateTimeField(blank=True, null=True, verbose_name='Start Processing Date')),
+                ('completed_processing_date', models.DateTimeField(blank=True, null=True, verbose_name='Complete Processing Date')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Feed Items')),
+                ('archived_date', models.DateTimeField(auto_now_add=True, verbose_name='Archived Date')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.Store')),
+            ],
+            options={
+                'verbose_name': 'Archived Feed',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedsubmissionarchive',
+            index=models.Index(fields=['store', 'submitted_date'], name='feed_archive_store_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedsubmissionarchive',
+            index=models.Index(fields=['feed_submission_id'], name='feed_archive_submission_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.5 on 2026-10-19 17:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import store.models
+import store.validators
+import utils.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_feed_submission_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='store',
+            name='csv',
+            field=models.FileField(blank=True, null=True, storage=utils.storage.ContentAddressedStorage(), upload_to=store.models.upload_path, validators=[store.validators.validate_csv_file_extension], verbose_name='File'),
+        ),
+        migrations.CreateModel(
+            name='InventoryUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('csv_filename', models.CharField(max_length=200, verbose_name='Filename')),
+                ('file', models.FileField(max_length=255, storage=utils.storage.ContentAddressedStorage(), upload_to='', verbose_name='File')),
+                ('sha256', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('size', models.PositiveIntegerField(verbose_name='Size')),
+                ('imported', models.BooleanField(default=True, verbose_name='Imported')),
+                ('csv_update_number', models.BigIntegerField(blank=True, null=True, verbose_name='Update Number')),
+                ('date', models.DateTimeField(auto_now_add=True, verbose_name='Date Time')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.Store')),
+            ],
+            options={
+                'verbose_name': 'Inventory Upload',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventoryupload',
+            index=models.Index(fields=['store', 'date'], name='inventory_upload_store_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.5 on 2026-10-19 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_inventory_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventoryupload',
+            name='row_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Rows'),
+        ),
+    ]
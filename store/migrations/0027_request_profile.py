@@ -0,0 +1,34 @@
+# Generated by Django 2.2.5 on 2026-10-19 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_inventory_upload_row_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10, verbose_name='Method')),
+                ('path', models.CharField(max_length=2000, verbose_name='Path')),
+                ('view_name', models.CharField(max_length=200, verbose_name='View')),
+                ('username', models.CharField(blank=True, max_length=150, verbose_name='User')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Status')),
+                ('duration', models.FloatField(verbose_name='Duration (s)')),
+                ('sample_count', models.PositiveIntegerField(verbose_name='Samples')),
+                ('query_count', models.PositiveIntegerField(verbose_name='Queries')),
+                ('query_duration', models.FloatField(verbose_name='Query Time (s)')),
+                ('collapsed_stacks', models.TextField(verbose_name='Collapsed Stacks')),
+                ('queries', models.TextField(verbose_name='SQL')),
+                ('date', models.DateTimeField(auto_now_add=True, verbose_name='Date Time')),
+            ],
+            options={
+                'verbose_name': 'Request Profile',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.5 on 2026-10-19 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0027_request_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MwsCall',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(db_index=True, verbose_name='Date Time')),
+                ('operation', models.CharField(max_length=100, verbose_name='Operation')),
+                ('seller_id', models.CharField(max_length=128, verbose_name='Seller ID')),
+                ('duration', models.FloatField(verbose_name='Duration (s)')),
+                ('outcome', models.CharField(max_length=20, verbose_name='Outcome')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status')),
+                ('request_bytes', models.PositiveIntegerField(verbose_name='Request Size')),
+                ('response_bytes', models.PositiveIntegerField(verbose_name='Response Size')),
+                ('quota_max', models.FloatField(blank=True, null=True, verbose_name='Quota')),
+                ('quota_remaining', models.FloatField(blank=True, null=True, verbose_name='Quota Remaining')),
+                ('quota_resets_on', models.DateTimeField(blank=True, null=True, verbose_name='Quota Resets On')),
+                ('request_id', models.CharField(blank=True, max_length=100, verbose_name='Request ID')),
+            ],
+            options={
+                'verbose_name': 'MWS Call',
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.5 on 2026-10-19 17:28
+
+from django.db import migrations, models
+import store.models
+import store.validators
+import utils.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0028_mws_call'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='store',
+            name='csv',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=utils.storage.ContentAddressedStorage(), upload_to=store.models.upload_path, validators=[store.validators.validate_csv_file_extension], verbose_name='File'),
+        ),
+    ]
@@ -1,30 +1,51 @@
+import json
 import logging
+import posixpath
 import uuid
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
 
 from django import forms
-from django.db import models, DEFAULT_DB_ALIAS
-from django.db.models import Max
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, connections, router, transaction, DEFAULT_DB_ALIAS, DatabaseError, IntegrityError
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.forms import ModelForm
 from django.utils import timezone
-from mws import MWSError
 
 from store.validators import validate_csv_file_extension
-from utils import aws
-from utils.helper import normalize_condition, get_conditions_tuple
-from utils.storage import OverWriteStorage, clear_folder
+from utils.db import after_write_lane, write_lane
+from utils.helper import get_conditions_tuple
+from utils.mws_trace import mws_call
+from utils.storage import ContentAddressedStorage, clear_folder, file_digest
 
 logger = logging.getLogger(__name__)
 
 _UPDATE_INVENTORY = 'update_inventory'
 _DELETE_CSV = 'delete_csv'
+_UPLOAD = 'inventory_upload'
+
+# Column layout of the inventory CSV files: read by position by store.ingest and written by the export.
+CSV_COLUMNS = ('upc', 'sku', 'sku_vendor', 'cost_price', 'drop_fee', 'shipment_price', 'standard_price', 'quantity',
+               'condition', 'handling_time', 'wholesale_name')
+# The export writes these after CSV_COLUMNS; the importer ignores them, so an exported file imports again.
+EXPORT_COLUMNS = CSV_COLUMNS + ('asin', 'item_name', 'sync_status')
+# Inventory fields whose changes are kept in InventoryChange.
+HISTORY_FIELDS = tuple(name for name in CSV_COLUMNS if name != 'sku')
 
 
 def upload_path(instance, filename):
     return 'csv/store_{0}/{1}'.format(instance.id, filename)
 
 
+csv_storage = ContentAddressedStorage()
+
+
 class Store(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField('Name', max_length=200)
@@ -33,7 +54,7 @@ class Store(models.Model):
     seller_id = models.CharField('Seller ID', max_length=128)
     auth_token = models.CharField('MWS Auth Token', max_length=255)
     csv = models.FileField('File', upload_to=upload_path, validators=[validate_csv_file_extension],
-                           storage=OverWriteStorage(), null=True, blank=True)
+                           storage=csv_storage, max_length=255, null=True, blank=True)
     csv_datetime = models.DateTimeField('Date Time', null=True, blank=True)
     csv_update_number = models.BigIntegerField('Update Number', null=True, blank=True)
     create_date = models.DateField('Creation date', auto_now_add=True)
@@ -46,8 +67,12 @@ class Store(models.Model):
     def __str__(self):
         return self.name
 
-    def save(self, *args, **kw):
-        super(Store, self).save(*args, **kw)
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if not self._state.adding and not force_insert and update_fields is None:
+            # csv_update_number is only advanced in the database, by next_csv_update_number.
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name != 'csv_update_number']
+        super(Store, self).save(force_insert, force_update, using, update_fields)
 
 
 class StoreFile(Store):
@@ -57,83 +82,124 @@ class StoreFile(Store):
         verbose_name_plural = 'Update Inventory'
 
 
+class InventoryUpload(models.Model):
+    """
+    One inventory CSV file uploaded for a store. Files are stored once per
+    content (csv_storage); an upload identical to the store's previous one is
+    recorded but not imported again.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    csv_filename = models.CharField('Filename', max_length=200)
+    file = models.FileField('File', storage=csv_storage, max_length=255)
+    sha256 = models.CharField('SHA-256', max_length=64)
+    size = models.PositiveIntegerField('Size')
+    # Lines after the header, counted while the file was streamed in; None when it was not.
+    row_count = models.PositiveIntegerField('Rows', null=True, blank=True)
+    imported = models.BooleanField('Imported', default=True)
+    csv_update_number = models.BigIntegerField('Update Number', null=True, blank=True)
+    date = models.DateTimeField('Date Time', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Inventory Upload'
+        indexes = [
+            models.Index(fields=['store', 'date'], name='inventory_upload_store_idx'),
+        ]
+
+    def __str__(self):
+        return self.csv_filename
+
+
+def prune_uploads(store, keep=None):
+    """
+    Forget all but the ``keep`` (default UPLOAD_HISTORY_COUNT) latest uploads of
+    ``store`` and delete the stored files no remaining upload refers to,
+    along with the ones failed requests left in the store's directory more
+    than UPLOAD_STALE_SECONDS ago.
+    """
+    if keep is None:
+        keep = settings.UPLOAD_HISTORY_COUNT
+    expired = list(InventoryUpload.objects.filter(store=store).order_by('-date', '-id')[keep:])
+    if expired:
+        InventoryUpload.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+    kept = set(InventoryUpload.objects.filter(store=store).values_list('file', flat=True))
+    kept.add(store.csv.name)
+    for name in ({upload.file.name for upload in expired} | _stale_files(store)) - kept:
+        # A rolled back prune keeps its uploads, so their files go only once it commits.
+        transaction.on_commit(partial(csv_storage.delete, name))
+    return len(expired)
+
+
+def _stale_files(store):
+    directory = posixpath.dirname(upload_path(store, 'x'))
+    try:
+        names = csv_storage.listdir(directory)[1]
+    except FileNotFoundError:
+        return set()
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_STALE_SECONDS)
+    stale = set()
+    for name in names:
+        name = posixpath.join(directory, name)
+        try:
+            if csv_storage.get_modified_time(name) < cutoff:
+                stale.add(name)
+        except FileNotFoundError:
+            continue
+    return stale
+
+
+def next_csv_update_number(store_id, using=None):
+    """
+    Advance the store's csv_update_number in a single atomic UPDATE and return
+    the new value, or None if there is no such store. Concurrent imports of a
+    store always get distinct numbers.
+    """
+    using = using or router.db_for_write(Store)
+    connection = connections[using]
+    if connection.vendor == 'postgresql' or (connection.vendor == 'sqlite'
+                                             and connection.Database.sqlite_version_info >= (3, 35)):
+        quote_name = connection.ops.quote_name
+        column = quote_name(Store._meta.get_field('csv_update_number').column)
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %(table)s SET %(column)s = COALESCE(%(column)s, 0) + 1 WHERE %(pk)s = %%s '
+                           'RETURNING %(column)s' % {'table': quote_name(Store._meta.db_table), 'column': column,
+                                                     'pk': quote_name(Store._meta.pk.column)},
+                           [Store._meta.pk.get_db_prep_value(store_id, connection)])
+            row = cursor.fetchone()
+        return row[0] if row else None
+    # No RETURNING: the UPDATE's row lock keeps the read-back ours until the transaction ends.
+    with transaction.atomic(using=using):
+        stores = Store.objects.using(using).filter(pk=store_id)
+        if not stores.update(csv_update_number=Coalesce(F('csv_update_number'), 0) + 1):
+            return None
+        return stores.values_list('csv_update_number', flat=True).get()
+
+
 @receiver(pre_save, sender=StoreFile)
 def _set_csv_fields(sender, instance, *args, **kwargs):
+    upload = getattr(instance, _UPLOAD, None)
+    if upload is not None and not upload.imported:
+        return
     instance.csv_datetime = timezone.now()
-    current_csv_update_number = Store.objects.filter(id=instance.id).aggregate(Max('csv_update_number'))
-    max_csv_update_number = current_csv_update_number['csv_update_number__max']
-    if max_csv_update_number is None:
-        max_csv_update_number = 0
-    instance.csv_update_number = max_csv_update_number + 1
+    # The first write of the upload: from here SQLite holds the write lock until the upload commits.
+    with write_lane(kwargs.get('using') or DEFAULT_DB_ALIAS):
+        instance.csv_update_number = next_csv_update_number(instance.id, kwargs.get('using')) or 1
 
 
 @receiver(post_save, sender=StoreFile)
 def _save_file(sender, instance, created, **kwargs):
-    if hasattr(instance, _UPDATE_INVENTORY):
-        with open(instance.csv.path, 'r') as csv_file:
-            iter_csv_file = iter(csv_file)
-            next(iter_csv_file)
-            for line in iter_csv_file:
-                columns = line.rstrip().split(',')
-                try:
-                    inventory = Inventory.objects.get(sku=columns[1], store=instance)
-                except Inventory.DoesNotExist:
-                    inventory = Inventory(sku=columns[1],
-                                          store=instance)
-                populate_inventory(columns, instance, inventory)
-                inventory.save()
-
-
-def populate_inventory(columns, instance, inventory):
-    inventory.upc = columns[0]
-    inventory.sku_vendor = columns[2]
-    inventory.cost_price = columns[3]
-    inventory.drop_fee = columns[4]
-    inventory.shipment_price = columns[5]
-
-    if inventory.standard_price != columns[6]:
-        inventory.sync_status = 0
-    inventory.standard_price = columns[6]  # feed
-
-    if inventory.quantity != columns[7]:
-        inventory.sync_status = 0
-    inventory.quantity = columns[7]  # feed
-
-    normalized_condition = normalize_condition(columns[8])
-    if inventory.condition != normalized_condition:
-        inventory.sync_status = 0
-    inventory.condition = normalized_condition  # feed
-
-    if inventory.handling_time != columns[9]:
-        inventory.sync_status = 0
-    inventory.handling_time = columns[9]  # feed
-
-    inventory.wholesale_name = columns[10]
-    inventory.csv_filename = str(instance.csv).rsplit('/', 1)[1]
-    inventory.csv_datetime = instance.csv_datetime
-    inventory.csv_update_number = instance.csv_update_number
-    try:
-        product = aws.get_items(instance.seller_id, instance.auth_token, [inventory.upc])
-    except MWSError as e:
-        logger.error(e)
+    if not hasattr(instance, _UPDATE_INVENTORY):
         return
-    logger.debug('product.parsed')
-    logger.debug(product.parsed)
-    if product.parsed:
-        if product.parsed['status'] and product.parsed['status']['value'] == 'ClientError':
-            logger.error(product.parsed['Error']['Message']['value'])
-        elif product.parsed['Products'] and product.parsed['Products']['Product']:
-            product_parsed = product.parsed['Products']['Product']
-            if isinstance(product_parsed, list):
-                product_parsed = product_parsed[0]
-            if product_parsed['Identifiers'] and product_parsed['Identifiers']['MarketplaceASIN'] and \
-                    product_parsed['Identifiers']['MarketplaceASIN']['ASIN']:
-                asin = product_parsed['Identifiers']['MarketplaceASIN']['ASIN']
-                inventory.asin = asin['value']
-            if product_parsed['AttributeSets'] and product_parsed['AttributeSets']['ItemAttributes'] and \
-                    product_parsed['AttributeSets']['ItemAttributes']['Title']:
-                title = product_parsed['AttributeSets']['ItemAttributes']['Title']
-                inventory.item_name = title['value']
+    upload = getattr(instance, _UPLOAD, None)
+    if upload is None:
+        upload = InventoryUpload(store=instance, csv_filename=instance.csv.name.rsplit('/', 1)[1],
+                                 sha256='', size=0)
+    if upload.imported:
+        from store.ingest import import_inventory
+        import_inventory(instance, instance.csv.path, upload.csv_filename)
+    upload.file = instance.csv.name
+    upload.csv_update_number = instance.csv_update_number
+    upload.save()
+    prune_uploads(instance)
 
 
 @receiver(post_delete, sender=Store)
@@ -156,6 +222,40 @@ class FeedSubmissionInfo(models.Model):
     started_processing_date = models.DateTimeField('Start Processing Date', blank=True, null=True)
     completed_processing_date = models.DateTimeField('Complete Processing Date', blank=True, null=True)
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    # Number of Inventory items submitted in the feed, set when the items are linked to it.
+    item_count = models.PositiveIntegerField('Feed Items', default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['feed_submission_id'], name='feed_submission_id_idx'),
+            models.Index(fields=['store', 'feed_processing_status'], name='feed_store_status_idx'),
+        ]
+
+
+class FeedSubmissionArchive(models.Model):
+    """
+    A completed FeedSubmissionInfo moved out of the hot tables by
+    store.retention: the feed and its item count, without the links to its
+    items. Its body and processing report stay in utils.archive.
+    """
+    # The id of the archived FeedSubmissionInfo, so archiving a feed twice is harmless.
+    id = models.UUIDField(primary_key=True, editable=False)
+    feed_submission_id = models.CharField('Feed Submission ID', max_length=200)
+    feed_type = models.CharField('Feed Type', max_length=200)
+    submitted_date = models.DateTimeField('Submitted Date')
+    feed_processing_status = models.CharField('Feed Processing Status', max_length=200)
+    started_processing_date = models.DateTimeField('Start Processing Date', blank=True, null=True)
+    completed_processing_date = models.DateTimeField('Complete Processing Date', blank=True, null=True)
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    item_count = models.PositiveIntegerField('Feed Items', default=0)
+    archived_date = models.DateTimeField('Archived Date', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Archived Feed'
+        indexes = [
+            models.Index(fields=['store', 'submitted_date'], name='feed_archive_store_date_idx'),
+            models.Index(fields=['feed_submission_id'], name='feed_archive_submission_idx'),
+        ]
 
 
 def inventory_form_factory(request, obj):
@@ -185,17 +285,29 @@ def inventory_form_factory(request, obj):
                 setattr(self.instance, _UPDATE_INVENTORY, 1)
                 if not cleaned_csv:
                     setattr(self.instance, _DELETE_CSV, old_csv)
+                else:
+                    # store.uploads.InventoryUploadHandler checked, hashed and counted it while it was uploaded.
+                    if getattr(cleaned_csv, 'header_error', None):
+                        raise forms.ValidationError(cleaned_csv.header_error)
+                    if not getattr(cleaned_csv, 'sha256', None):
+                        cleaned_csv.sha256 = file_digest(cleaned_csv)
+                    previous = InventoryUpload.objects.filter(store_id=self.instance.pk).order_by('-date', '-id') \
+                        .values_list('sha256', flat=True).first()
+                    setattr(self.instance, _UPLOAD, InventoryUpload(
+                        store_id=self.instance.pk, csv_filename=cleaned_csv.name, sha256=cleaned_csv.sha256,
+                        size=cleaned_csv.size, row_count=getattr(cleaned_csv, 'row_count', None),
+                        imported=cleaned_csv.sha256 != previous))
             return cleaned_csv
     return InventoryForm
 
 
 class Inventory(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    upc = models.CharField('UPC', max_length=200)
-    asin = models.CharField('ASIN', max_length=200, null=True, blank=True)
+    upc = models.CharField('UPC', max_length=200, db_index=True)
+    asin = models.CharField('ASIN', max_length=200, null=True, blank=True, db_index=True)
     item_name = models.CharField('Item Name', max_length=200, null=True, blank=True)
-    sku = models.CharField('SKU', max_length=200)
-    sku_vendor = models.CharField('SKU Vendor', max_length=200)
+    sku = models.CharField('SKU', max_length=200, db_index=True)
+    sku_vendor = models.CharField('SKU Vendor', max_length=200, db_index=True)
     cost_price = models.DecimalField('Cost Price', max_digits=12, decimal_places=2)
     drop_fee = models.DecimalField('Drop Fee', max_digits=12, decimal_places=2)
     shipment_price = models.DecimalField('Shipment Price', max_digits=12, decimal_places=2)
@@ -217,10 +329,11 @@ class Inventory(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE, blank=True, null=True)
     feed_submission_info = models.ManyToManyField(FeedSubmissionInfo, blank=True)
 
-    __original_standard_price = None
-    __original_quantity = None
-    __original_condition = None
-    __original_handling_time = None
+    # Changing any of these means the item has to be fed to Amazon again.
+    FEED_FIELDS = ('standard_price', 'quantity', 'condition', 'handling_time')
+
+    # Field names and values of the row the instance was read from, see from_db and loaded_values.
+    _loaded = None
 
     class Meta:
         verbose_name = 'Inventory'
@@ -228,27 +341,274 @@ class Inventory(models.Model):
         permissions = (
             ('sync_inventory', 'Can feed permission'),
         )
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.__original_standard_price = self.standard_price
-        self.__original_quantity = self.quantity
-        self.__original_condition = self.condition
-        self.__original_handling_time = self.handling_time
+        indexes = [
+            models.Index(fields=['store', 'sync_status'], name='inventory_store_sync_idx'),
+            models.Index(fields=['store', 'id'], name='inventory_store_id_idx'),
+            models.Index(fields=['store', 'csv_update_number'], name='inventory_store_update_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'sku'], name='inventory_store_sku_uniq'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = (field_names, values)
+        return instance
 
     def __str__(self):
         return self.sku
 
+    def loaded_values(self):
+        """Field values by attname as last read from or saved to the database; empty for new instances."""
+        if self._loaded is None:
+            return {}
+        if isinstance(self._loaded, tuple):
+            self._loaded = dict(zip(*self._loaded))
+        return self._loaded
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        loaded = dict(self.loaded_values())
+        for field in self._meta.concrete_fields:
+            if (fields is None or field.attname in fields or field.name in fields) and field.attname in self.__dict__:
+                loaded[field.attname] = self.__dict__[field.attname]
+        self._loaded = loaded
+
+    def changed_fields(self):
+        loaded = self.loaded_values()
+        return [field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname in self.__dict__
+                and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])]
+
+    def stats_snapshot(self, loaded=False):
+        """The InventoryStats bucket the item counts towards and its stock value, as loaded or as it is now."""
+        values = self.loaded_values()
+        return stats_snapshot(values if loaded else dict(values, **self.__dict__))
+
     def save(self, force_insert=False, force_update=False, using=DEFAULT_DB_ALIAS, update_fields=None):
-        if self.__original_standard_price != self.standard_price \
-                or self.__original_quantity != self.quantity \
-                or self.__original_condition != self.condition \
-                or self.__original_handling_time != self.handling_time:
-            self.sync_status = 0
+        adding = self._state.adding
+        if not adding:
+            missing = [name for name in STATS_FIELDS if name not in self.loaded_values()]
+            if missing:
+                # Deferred or never loaded: read what the stats need from the stored row.
+                stored = type(self)._base_manager.using(using).filter(pk=self.pk).values(*missing).first()
+                if stored is not None:
+                    self._loaded = dict(self.loaded_values(), **stored)
+            if update_fields is None:
+                update_fields = self.changed_fields()
+                if 'sync_status' not in update_fields and any(name in update_fields for name in self.FEED_FIELDS):
+                    self.sync_status = 0
+                    update_fields.append('sync_status')
+        original = None if adding else self.stats_snapshot(loaded=True)
 
         super().save(force_insert, force_update, using, update_fields)
 
-        self.__original_standard_price = self.standard_price
-        self.__original_quantity = self.quantity
-        self.__original_condition = self.condition
-        self.__original_handling_time = self.handling_time
+        self._loaded = dict(self.loaded_values(), **{field.attname: self.__dict__[field.attname]
+                                                     for field in self._meta.concrete_fields
+                                                     if field.attname in self.__dict__})
+        update_inventory_stats(removed=[original], added=[self.stats_snapshot()])
+
+    def delete(self, using=None, keep_parents=False):
+        original = self.stats_snapshot(loaded=self._loaded is not None)
+        deleted = super().delete(using, keep_parents)
+        update_inventory_stats(removed=[original])
+        return deleted
+
+
+class InventoryChange(models.Model):
+    """
+    The CSV fields an import (or a rollback) changed on one SKU, with their
+    values before and after, stored as JSON ``{field: [old, new]}``.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    sku = models.CharField('SKU', max_length=200)
+    csv_update_number = models.BigIntegerField('Update Number')
+    created = models.BooleanField('New Item', default=False)
+    changes = models.TextField('Changes')
+    date = models.DateTimeField('Date Time', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Inventory Change'
+        verbose_name_plural = 'Inventory History'
+        indexes = [
+            models.Index(fields=['store', 'csv_update_number'], name='inventory_change_update_idx'),
+            models.Index(fields=['store', 'sku', 'csv_update_number'], name='inventory_change_sku_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.sku, self.csv_update_number)
+
+    def changed_values(self):
+        """``{field: (old, new)}`` with the values converted back to their Python types."""
+        return {name: tuple(Inventory._meta.get_field(name).to_python(value) for value in values)
+                for name, values in json.loads(self.changes).items()}
+
+
+def inventory_change(inventory, csv_update_number):
+    """
+    An unsaved InventoryChange for the history fields ``inventory`` is about
+    to write, or None if it changes none of them. Call it before saving.
+    """
+    loaded = inventory.loaded_values()
+    changes = {name: [loaded.get(name), getattr(inventory, name)] for name in inventory.changed_fields()
+               if name in HISTORY_FIELDS}
+    if not changes:
+        return None
+    return InventoryChange(store_id=inventory.store_id, sku=inventory.sku, csv_update_number=csv_update_number,
+                           created=inventory._state.adding, changes=json.dumps(changes, cls=DjangoJSONEncoder))
+
+
+class InventoryStats(models.Model):
+    """
+    Item count and stock value (cost price x quantity) of a store's inventory
+    per sync status and condition, kept up to date by the code that writes
+    Inventory rows (see update_inventory_stats) rather than counted on read.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    sync_status = models.SmallIntegerField('Sync Status', choices=Inventory.SYNC_STATUS_CHOICES)
+    condition = models.CharField('Condition', max_length=200, choices=get_conditions_tuple())
+    items = models.IntegerField('Items', default=0)
+    stock_value = models.DecimalField('Stock Value', max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'Inventory Stats'
+        verbose_name_plural = 'Inventory Stats'
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'sync_status', 'condition'], name='inventory_stats_bucket_uniq'),
+        ]
+
+
+# Inventory fields stats_snapshot reads, by attname.
+STATS_FIELDS = ('store_id', 'sync_status', 'condition', 'cost_price', 'quantity')
+
+
+def stats_snapshot(values):
+    """
+    The InventoryStats bucket and stock value of an Inventory item, from its
+    field values by attname. None when they are not all known.
+    """
+    try:
+        bucket = values['store_id'], values['sync_status'], values['condition']
+        value = Decimal(values['cost_price']) * values['quantity']
+    except (KeyError, TypeError):
+        return None
+    if bucket[0] is None:
+        return None
+    return bucket, value
+
+
+def update_inventory_stats(removed=(), added=()):
+    """
+    Move the ``removed`` item snapshots out of their InventoryStats buckets and
+    the ``added`` ones into theirs, with one UPDATE per bucket that changed.
+    """
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for sign, snapshots in ((-1, removed), (1, added)):
+        for snapshot in snapshots:
+            if snapshot is None:
+                continue
+            bucket, value = snapshot
+            deltas[bucket][0] += sign
+            deltas[bucket][1] += sign * value
+    for (store_id, sync_status, condition), (items, value) in deltas.items():
+        if not items and not value:
+            continue
+        bucket = InventoryStats.objects.filter(store_id=store_id, sync_status=sync_status, condition=condition)
+        if bucket.update(items=F('items') + items, stock_value=F('stock_value') + value):
+            continue
+        try:
+            with transaction.atomic():
+                InventoryStats.objects.create(store_id=store_id, sync_status=sync_status, condition=condition,
+                                              items=items, stock_value=value)
+        except IntegrityError:
+            bucket.update(items=F('items') + items, stock_value=F('stock_value') + value)
+
+
+def stored_inventory_count(store_id=None):
+    """
+    Items of one store, or of every store when ``store_id`` is None, read
+    from the InventoryStats totals instead of counting Inventory rows. Items
+    without a store have no stats and are counted directly, on the store index.
+    """
+    stats = InventoryStats.objects.all()
+    if store_id is not None:
+        stats = stats.filter(store_id=store_id)
+    count = stats.aggregate(items=Sum('items'))['items'] or 0
+    if store_id is None:
+        count += Inventory.objects.filter(store=None).count()
+    return count
+
+
+class RequestProfile(models.Model):
+    """
+    A request profiled by store.profiling.ProfilingMiddleware: its sampled
+    stacks in the collapsed format and the SQL it ran, as JSON.
+    """
+    method = models.CharField('Method', max_length=10)
+    path = models.CharField('Path', max_length=2000)
+    view_name = models.CharField('View', max_length=200)
+    username = models.CharField('User', max_length=150, blank=True)
+    status_code = models.PositiveSmallIntegerField('Status')
+    duration = models.FloatField('Duration (s)')
+    sample_count = models.PositiveIntegerField('Samples')
+    query_count = models.PositiveIntegerField('Queries')
+    query_duration = models.FloatField('Query Time (s)')
+    collapsed_stacks = models.TextField('Collapsed Stacks')
+    queries = models.TextField('SQL')
+    date = models.DateTimeField('Date Time', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Request Profile'
+
+    def __str__(self):
+        return '%s %s' % (self.method, self.path)
+
+
+class MwsCall(models.Model):
+    """One traced MWS call, stored when settings.MWS_TRACE_TABLE is on."""
+    date = models.DateTimeField('Date Time', db_index=True)
+    operation = models.CharField('Operation', max_length=100)
+    seller_id = models.CharField('Seller ID', max_length=128)
+    duration = models.FloatField('Duration (s)')
+    outcome = models.CharField('Outcome', max_length=20)
+    status_code = models.PositiveSmallIntegerField('Status', null=True, blank=True)
+    request_bytes = models.PositiveIntegerField('Request Size')
+    response_bytes = models.PositiveIntegerField('Response Size')
+    quota_max = models.FloatField('Quota', null=True, blank=True)
+    quota_remaining = models.FloatField('Quota Remaining', null=True, blank=True)
+    quota_resets_on = models.DateTimeField('Quota Resets On', null=True, blank=True)
+    request_id = models.CharField('Request ID', max_length=100, blank=True)
+
+    class Meta:
+        verbose_name = 'MWS Call'
+
+    def __str__(self):
+        return '%s %s' % (self.operation, self.seller_id)
+
+
+_mws_calls_pruned = 0.0
+
+
+@receiver(mws_call)
+def _record_mws_call(sender, trace, **kwargs):
+    if not settings.MWS_TRACE_TABLE:
+        return
+    # Written once this thread leaves the write lane, so the row never waits on or for a bulk writer.
+    after_write_lane(partial(_store_mws_call, trace))
+
+
+def _store_mws_call(trace):
+    global _mws_calls_pruned
+    # A trace is not worth the call it describes: a failed write is logged, never raised in its place.
+    try:
+        with transaction.atomic():
+            MwsCall.objects.create(**trace)
+            # Calls older than MWS_TRACE_RETENTION_DAYS are dropped, at most once an hour per process.
+            now = timezone.now()
+            if now.timestamp() - _mws_calls_pruned >= 3600:
+                _mws_calls_pruned = now.timestamp()
+                MwsCall.objects.filter(date__lt=now - timedelta(days=settings.MWS_TRACE_RETENTION_DAYS)).delete()
+    except DatabaseError as e:
+        logger.error('Unable to store the trace of an MWS %(operation)s call: %(error)s' %
+                     {'operation': trace['operation'], 'error': e})
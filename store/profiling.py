@@ -0,0 +1,72 @@
+import json
+import logging
+import random
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+from store.models import RequestProfile
+from utils.profiling import StackSampler, QueryLog
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+
+def _requested(request):
+    """Whether a superuser asked for this request to be profiled, by header or query flag."""
+    asked = request.META.get(PROFILE_HEADER) == '1' or PROFILE_PARAM in request.GET
+    if PROFILE_PARAM in request.GET:
+        # The admin changelists treat unknown query parameters as filters.
+        request.GET = request.GET.copy()
+        del request.GET[PROFILE_PARAM]
+        request.GET._mutable = False
+    return asked and request.user.is_superuser
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile a request when a superuser asks for it with ``X-Profile: 1`` or
+    ``?_profile``, or at random for a PROFILE_SAMPLE_RATE fraction of all
+    requests: a StackSampler samples the request's thread every
+    PROFILE_INTERVAL seconds and every query is logged. The capture is saved
+    as a RequestProfile, keeping the latest PROFILE_HISTORY_COUNT.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _requested(request) and random.random() >= settings.PROFILE_SAMPLE_RATE:
+            return self.get_response(request)
+        query_log = QueryLog()
+        sampler = StackSampler(settings.PROFILE_INTERVAL)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+        match = getattr(request, 'resolver_match', None)
+        try:
+            RequestProfile.objects.create(
+                method=request.method,
+                path=request.get_full_path()[:2000],
+                view_name=match.view_name[:200] if match is not None else 'unresolved',
+                username=request.user.get_username() if request.user.is_authenticated else '',
+                status_code=response.status_code,
+                duration=sampler.duration,
+                sample_count=sampler.samples,
+                query_count=query_log.count,
+                query_duration=query_log.seconds,
+                collapsed_stacks=sampler.collapsed(),
+                queries=json.dumps(query_log.queries))
+            expired = RequestProfile.objects.order_by('-date', '-id').values_list('pk', flat=True)[
+                settings.PROFILE_HISTORY_COUNT:]
+            RequestProfile.objects.filter(pk__in=list(expired)).delete()
+        except DatabaseError as e:
+            logger.error('Unable to save the profile of %(path)s: %(error)s' % {'path': request.path, 'error': e})
+        return response
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from store.models import Inventory, FeedSubmissionInfo, FeedSubmissionArchive
+from utils.db import chunked_queryset, write_lane
+
+# Item links deleted per statement: feeds can link SYNC_CHUNK_SIZE items each.
+_LINK_BATCH_SIZE = 5000
+
+# Feeds Amazon is done with: processed (with or without errors), cancelled, or whose report was unreadable.
+COMPLETED_FEEDS = Q(feed_processing_status__startswith='_DONE_') | \
+    Q(feed_processing_status__in=['_CANCELLED_', '_DATA_CORRUPTION_'])
+
+
+def archivable_feeds(days=None):
+    """Completed feeds submitted more than ``days`` (default FEED_RETENTION_DAYS) days ago."""
+    if days is None:
+        days = settings.FEED_RETENTION_DAYS
+    return FeedSubmissionInfo.objects.filter(COMPLETED_FEEDS, submitted_date__lt=timezone.now() - timedelta(days=days))
+
+
+def archive_feeds(days=None, batch_size=None, pause=0):
+    """
+    Move the archivable feeds into FeedSubmissionArchive ``batch_size`` feeds
+    at a time: copy their summaries, delete their item links in short
+    transactions of ``_LINK_BATCH_SIZE`` rows, then delete the feeds,
+    sleeping ``pause`` seconds between batches to leave room for other
+    writers. Safe to interrupt and run again. Return the number of archived
+    feeds and deleted links.
+    """
+    batch_size = batch_size or settings.FEED_RETENTION_BATCH_SIZE
+    through = Inventory.feed_submission_info.through
+    archived = unlinked = 0
+    for feeds in chunked_queryset(archivable_feeds(days), batch_size):
+        ids = [feed.pk for feed in feeds]
+        FeedSubmissionArchive.objects.bulk_create([archived_feed(feed) for feed in feeds], ignore_conflicts=True)
+        links = through.objects.filter(feedsubmissioninfo_id__in=ids)
+        while True:
+            with write_lane(), transaction.atomic():
+                link_ids = list(links.values_list('pk', flat=True)[:_LINK_BATCH_SIZE])
+                if not link_ids:
+                    break
+                through.objects.filter(pk__in=link_ids).delete()
+            unlinked += len(link_ids)
+        with write_lane(), transaction.atomic():
+            FeedSubmissionInfo.objects.filter(pk__in=ids).delete()
+        archived += len(feeds)
+        if pause:
+            time.sleep(pause)
+    return archived, unlinked
+
+
+def archived_feed(feed):
+    return FeedSubmissionArchive(id=feed.pk,
+                                 feed_submission_id=feed.feed_submission_id,
+                                 feed_type=feed.feed_type,
+                                 submitted_date=feed.submitted_date,
+                                 feed_processing_status=feed.feed_processing_status,
+                                 started_processing_date=feed.started_processing_date,
+                                 completed_processing_date=feed.completed_processing_date,
+                                 store_id=feed.store_id,
+                                 item_count=feed.item_count)
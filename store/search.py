@@ -0,0 +1,110 @@
+import re
+
+from django.db import connections, DatabaseError
+from django.db.models import Q
+
+from store.models import Inventory
+
+FTS_TABLE = 'store_inventory_fts'
+# The FTS5 rowid has to be stable, but store_inventory only has an implicit rowid (its primary key is a
+# UUID), which VACUUM may renumber. This table gives every item an INTEGER PRIMARY KEY that never changes.
+FTS_KEY_TABLE = 'store_inventory_fts_key'
+CODE_FIELDS = ('sku', 'upc', 'sku_vendor', 'asin')
+
+# SQLite keeps the FTS5 index in step with store_inventory through these triggers.
+_FTS_TRIGGERS = {
+    'store_inventory_fts_insert': """
+        CREATE TRIGGER store_inventory_fts_insert AFTER INSERT ON store_inventory BEGIN
+            INSERT INTO store_inventory_fts_key (inventory_id) VALUES (new.id);
+            INSERT INTO store_inventory_fts (rowid, item_name)
+            VALUES ((SELECT id FROM store_inventory_fts_key WHERE inventory_id = new.id), new.item_name);
+        END""",
+    'store_inventory_fts_delete': """
+        CREATE TRIGGER store_inventory_fts_delete AFTER DELETE ON store_inventory BEGIN
+            DELETE FROM store_inventory_fts
+            WHERE rowid = (SELECT id FROM store_inventory_fts_key WHERE inventory_id = old.id);
+            DELETE FROM store_inventory_fts_key WHERE inventory_id = old.id;
+        END""",
+    'store_inventory_fts_update': """
+        CREATE TRIGGER store_inventory_fts_update AFTER UPDATE OF item_name ON store_inventory BEGIN
+            UPDATE store_inventory_fts SET item_name = new.item_name
+            WHERE rowid = (SELECT id FROM store_inventory_fts_key WHERE inventory_id = new.id);
+        END""",
+}
+
+_fts_ready = {}
+
+
+def ensure_search_index(connection):
+    """
+    Create the SQLite FTS5 index over Inventory.item_name, its key table and
+    its triggers, rebuilding them from store_inventory when any is missing.
+    Migrations that rebuild store_inventory on SQLite drop the triggers, so
+    this runs after every migrate. Returns whether the index is usable.
+    """
+    if connection.vendor != 'sqlite' or 'store_inventory' not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'store_inventory'")
+        triggers = {row[0] for row in cursor.fetchall()}
+        if not set(_FTS_TRIGGERS) <= triggers or FTS_KEY_TABLE not in connection.introspection.table_names():
+            try:
+                cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+                cursor.execute('CREATE VIRTUAL TABLE %s USING fts5(item_name)' % FTS_TABLE)
+            except DatabaseError:
+                # SQLite built without FTS5: item names are searched with LIKE.
+                _fts_ready[connection.alias] = False
+                return False
+            for name in _FTS_TRIGGERS:
+                cursor.execute('DROP TRIGGER IF EXISTS %s' % name)
+            cursor.execute('DROP TABLE IF EXISTS %s' % FTS_KEY_TABLE)
+            cursor.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, inventory_id char(32) NOT NULL UNIQUE)'
+                           % FTS_KEY_TABLE)
+            cursor.execute('INSERT INTO %s (inventory_id) SELECT id FROM store_inventory' % FTS_KEY_TABLE)
+            cursor.execute('INSERT INTO %s (rowid, item_name) SELECT k.id, i.item_name FROM %s k '
+                           'JOIN store_inventory i ON i.id = k.inventory_id' % (FTS_TABLE, FTS_KEY_TABLE))
+            for sql in _FTS_TRIGGERS.values():
+                cursor.execute(sql)
+    _fts_ready[connection.alias] = True
+    return True
+
+
+def _has_fts(connection):
+    if connection.alias not in _fts_ready:
+        tables = connection.introspection.table_names()
+        _fts_ready[connection.alias] = FTS_TABLE in tables and FTS_KEY_TABLE in tables
+    return _fts_ready[connection.alias]
+
+
+def _code_q(field, term, connection):
+    if connection.vendor == 'sqlite':
+        # SQLite cannot use an index for Django's LIKE ... ESCAPE, but it can for the equivalent range.
+        return Q(**{'%s__gte' % field: term, '%s__lt' % field: term + '\U0010ffff'})
+    return Q(**{'%s__startswith' % field: term})
+
+
+def _item_name_q(term, connection):
+    words = re.findall(r'\w+', term)
+    if connection.vendor == 'sqlite' and words and _has_fts(connection):
+        match = ' '.join('"%s"*' % word for word in words)
+        matches = Inventory.objects.extra(where=['id IN (SELECT inventory_id FROM %s WHERE id IN (SELECT rowid FROM %s '
+                                                 'WHERE %s MATCH %%s))' % (FTS_KEY_TABLE, FTS_TABLE, FTS_TABLE)],
+                                          params=[match]).values('pk')
+        return Q(pk__in=matches)
+    # On PostgreSQL each word is served by the pg_trgm index on UPPER(item_name).
+    q = Q()
+    for word in words or [term]:
+        q &= Q(item_name__icontains=word)
+    return q
+
+
+def search_inventory(queryset, term):
+    """
+    Inventory items whose SKU, UPC, vendor SKU or ASIN starts with ``term``,
+    or whose item name contains every word of it.
+    """
+    connection = connections[queryset.db]
+    q = _item_name_q(term, connection)
+    for field in CODE_FIELDS:
+        q |= _code_q(field, term, connection)
+    return queryset.filter(q)
@@ -0,0 +1,195 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from mws import MWSError
+
+from store.models import Store, Inventory, FeedSubmissionInfo, update_inventory_stats
+from utils.aws import update_store, ThrottlingException
+from utils.db import chunked_queryset, write_lane
+
+logger = logging.getLogger(__name__)
+
+_BATCH_SIZE = 500
+
+_seller_semaphores = {}
+_seller_semaphores_lock = threading.Lock()
+_global_semaphore = threading.BoundedSemaphore(getattr(settings, 'MWS_SYNC_MAX_WORKERS', 4))
+
+
+def _seller_semaphore(seller_id):
+    with _seller_semaphores_lock:
+        if seller_id not in _seller_semaphores:
+            _seller_semaphores[seller_id] = threading.BoundedSemaphore(
+                getattr(settings, 'MWS_SYNC_MAX_PER_SELLER', 1))
+        return _seller_semaphores[seller_id]
+
+
+class StoreSyncResult(object):
+    def __init__(self, store, count=0, error=None):
+        self.store = store
+        self.count = count
+        self.error = error
+
+    @property
+    def throttled(self):
+        return isinstance(self.error, ThrottlingException)
+
+
+def sync_stores(queryset, operation, chunk_size=None):
+    """
+    Submit the items in ``queryset`` to MWS store by store, running the stores
+    concurrently. At most ``MWS_SYNC_MAX_WORKERS`` submissions run at once in
+    this process and at most ``MWS_SYNC_MAX_PER_SELLER`` per seller. Each
+    store's items are streamed in keyset-paginated chunks of ``chunk_size``
+    (``SYNC_CHUNK_SIZE`` by default), one feed per chunk, so memory stays flat
+    whatever the size of the selection. Return a ``StoreSyncResult`` per store.
+    """
+    store_ids = queryset.exclude(store=None).order_by().values_list('store', flat=True).distinct()
+    stores = Store.objects.filter(pk__in=list(store_ids))
+    return _run_per_store(list(stores), _feed_job(queryset, operation, chunk_size))
+
+
+def sync_pending_stores(stores, chunk_size=None):
+    """
+    Feed every item of each store in ``stores`` that changed since it was last
+    fed (``sync_status`` 0), streaming them from the (store, sync_status) index.
+    Stores run concurrently and in chunks, like ``sync_stores``.
+    """
+    pending = Inventory.objects.filter(sync_status=0)
+    return _run_per_store(list(stores), _feed_job(pending, 'update', chunk_size))
+
+
+def _feed_job(queryset, operation, chunk_size):
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'SYNC_CHUNK_SIZE', 5000)
+
+    def feed(store, result):
+        for chunk in chunked_queryset(queryset.filter(store=store), chunk_size):
+            call_mws(store, chunk, operation)
+            result.count += len(chunk)
+    return feed
+
+
+def stores_with_pending_items():
+    pending = Inventory.objects.filter(store=OuterRef('pk'), sync_status=0)
+    return Store.objects.annotate(has_pending=Exists(pending)).filter(has_pending=True)
+
+
+def _run_per_store(stores, job):
+    """
+    Run ``job`` for every store and return their results in order. The stores
+    of one seller are queued into at most ``MWS_SYNC_MAX_PER_SELLER`` lanes,
+    and each worker drains one lane, so a worker never sits idle waiting for
+    its seller while stores of other sellers wait for a worker.
+    """
+    if not stores:
+        return []
+    queues = OrderedDict()
+    for index, store in enumerate(stores):
+        queues.setdefault(store.seller_id, deque()).append((index, store))
+    per_seller = getattr(settings, 'MWS_SYNC_MAX_PER_SELLER', 1)
+    lanes = [queue for queue in queues.values() for _ in range(min(len(queue), per_seller))]
+    results = [None] * len(stores)
+    max_workers = min(len(lanes), getattr(settings, 'MWS_SYNC_MAX_WORKERS', 4))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_sync_lane, lane, job, results) for lane in lanes]
+        for future in futures:
+            future.result()
+    return results
+
+
+def _sync_lane(lane, job, results):
+    try:
+        while True:
+            try:
+                index, store = lane.popleft()
+            except IndexError:
+                return
+            results[index] = _sync_store(store, job)
+    finally:
+        # Worker threads open their own connection; don't leak it once the batch is done.
+        connection.close()
+
+
+def _sync_store(store, job):
+    result = StoreSyncResult(store)
+    try:
+        # Seller first: a global slot is only taken once the call can actually run.
+        with _seller_semaphore(store.seller_id), _global_semaphore:
+            job(store, result)
+    except (ThrottlingException, MWSError, ConnectionError) as e:
+        if not isinstance(e, ThrottlingException):
+            logger.error(e)
+        result.error = e
+    return result
+
+
+def call_mws(store, objects, operation):
+    sent = {item.pk: _feed_values(item) for item in objects}
+    store.last_execution, product_return, price_return, inventory_return = update_store(store,
+                                                                                        objects,
+                                                                                        operation)
+    store.save(update_fields=['last_execution'])
+    feed_infos = []
+    if product_return:
+        feed_infos.append(save_return(product_return['FeedSubmissionInfo'], store, len(objects)))
+    if price_return:
+        feed_infos.append(save_return(price_return['FeedSubmissionInfo'], store, len(objects)))
+    if inventory_return:
+        feed_infos.append(save_return(inventory_return['FeedSubmissionInfo'], store, len(objects)))
+    with write_lane(), transaction.atomic():
+        link_feed_items(feed_infos, objects)
+        # Read the items again: one an import changed during the MWS call was fed its old values and stays pending.
+        fed = [item for item in _locked_items(list(sent))
+               if item.sync_status != 1 and _feed_values(item) == sent[item.pk]]
+        removed = [item.stats_snapshot() for item in fed]
+        for item in fed:
+            item.sync_status = 1
+        Inventory.objects.bulk_update(fed, ['sync_status'], batch_size=_BATCH_SIZE)
+        update_inventory_stats(removed, [item.stats_snapshot() for item in fed])
+
+
+def _feed_values(item):
+    return tuple(getattr(item, name) for name in Inventory.FEED_FIELDS)
+
+
+def _locked_items(pks):
+    """The items with primary keys ``pks`` as stored now, locked until the transaction ends where supported."""
+    fields = set(Inventory.FEED_FIELDS) | {'store', 'sync_status', 'condition', 'cost_price', 'quantity'}
+    items = []
+    for start in range(0, len(pks), _BATCH_SIZE):
+        items.extend(Inventory.objects.select_for_update().filter(pk__in=pks[start:start + _BATCH_SIZE])
+                     .only(*fields))
+    return items
+
+
+def link_feed_items(feed_infos, objects):
+    """
+    Link every item in ``objects`` to every feed in ``feed_infos`` by inserting
+    the through-table rows directly, one INSERT per chunk of items.
+    """
+    through = Inventory.feed_submission_info.through
+    for start in range(0, len(objects), _BATCH_SIZE):
+        through.objects.bulk_create([through(inventory_id=item.pk, feedsubmissioninfo_id=feed_info.pk)
+                                     for item in objects[start:start + _BATCH_SIZE]
+                                     for feed_info in feed_infos])
+
+
+def save_return(feed_submission_info, store, item_count=0):
+    feed_submission_id = feed_submission_info['FeedSubmissionId']['value']
+    feed_type = feed_submission_info['FeedType']['value']
+    submitted_date = feed_submission_info['SubmittedDate']['value']
+    feed_processing_status = feed_submission_info['FeedProcessingStatus']['value']
+    feed_info = FeedSubmissionInfo(feed_submission_id=feed_submission_id,
+                                   feed_type=feed_type,
+                                   submitted_date=submitted_date,
+                                   feed_processing_status=feed_processing_status,
+                                   store=store,
+                                   item_count=item_count)
+    feed_info.save()
+    return feed_info
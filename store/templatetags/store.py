@@ -1,7 +1,11 @@
+from collections import OrderedDict
+from decimal import Decimal
+
 from django import template
 from django.urls import reverse
 
-from utils.helper import mws_normalize_condition
+from store.models import Store, Inventory, InventoryStats
+from utils.helper import mws_normalize_condition, get_conditions_tuple
 
 register = template.Library()
 
@@ -29,3 +33,32 @@ def has_perm(user, perm):
     if user.is_superuser or user.store:
         return user.has_perm(perm)
     return False
+
+
+@register.simple_tag
+def get_inventory_summary(user):
+    """
+    Per-store item counts by sync status and condition, stock value and last
+    import/sync times, read from the maintained InventoryStats rows.
+    """
+    if not has_perm(user, 'store.view_inventory'):
+        return []
+    stores = Store.objects.order_by('name')
+    if not user.is_superuser:
+        stores = stores.filter(pk=user.store.pk)
+    summary = OrderedDict((store.pk, {
+        'store': store,
+        'statuses': OrderedDict((status, 0) for status, label in Inventory.SYNC_STATUS_CHOICES),
+        'conditions': OrderedDict(),
+        'items': 0,
+        'stock_value': Decimal(0),
+    }) for store in stores)
+    conditions = dict(get_conditions_tuple())
+    for bucket in InventoryStats.objects.filter(store__in=list(summary), items__gt=0).order_by('condition'):
+        row = summary[bucket.store_id]
+        row['statuses'][bucket.sync_status] = row['statuses'].get(bucket.sync_status, 0) + bucket.items
+        label = conditions.get(bucket.condition, bucket.condition)
+        row['conditions'][label] = row['conditions'].get(label, 0) + bucket.items
+        row['items'] += bucket.items
+        row['stock_value'] += bucket.stock_value
+    return list(summary.values())
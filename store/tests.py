@@ -1,3 +1,768 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.admin import helpers
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.paginator import Paginator
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction, OperationalError
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from store.admin import InventoryAdmin
+from store.history import inventory_as_of, rollback_store
+from store.ingest import _batched_merge, _copy_merge, parse_row
+from store.models import Store, Inventory, InventoryChange, InventoryStats, InventoryUpload, FeedSubmissionInfo, \
+    MwsCall, RequestProfile, CSV_COLUMNS, csv_storage, next_csv_update_number, prune_uploads, upload_path
+from store.search import CODE_FIELDS, _code_q, search_inventory
+from store.sync import call_mws
+from store.templatetags.store import get_inventory_summary
+from utils import metrics, mws_trace, thread_local
+from utils.aws import MeteredProducts, ThrottlingException
+from utils.db import REPLICA_PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter, replica_reads, write_lane
+from utils.paginator import SeekPaginator
+from utils.profiling import StackSampler
+
+
+def _rows(*lines):
+    return [parse_row(line.split(',')) for line in lines]
+
+
+def _item(store, sku, **fields):
+    values = dict(upc='u', sku_vendor='v', cost_price=1, drop_fee=1, shipment_price=1, standard_price=1, quantity=1,
+                  condition='new', handling_time=1, wholesale_name='w')
+    values.update(fields)
+    return Inventory(store=store, sku=sku, **values)
+
+
+def _plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        # Fresh statistics, and no sequential scans: the test tables are too small for any index to win otherwise.
+        cursor.execute('ANALYZE %s' % queryset.model._meta.db_table)
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _indexed_conditions(queryset):
+    """The conditions of ``queryset`` that its query plan looks up in an index, as text."""
+    # e.g. SEARCH store_inventory USING INDEX inventory_store_update_idx (store_id=? AND ...), or Index Cond: ...
+    return ' '.join(line for line in _plan(queryset) if 'USING' in line or 'Index Cond' in line)
+
+
+def _leading_index_columns(queryset):
+    """The first column of every index the query plan of ``queryset`` uses."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, queryset.model._meta.db_table)
+    indexes = re.findall(r'(?:INDEX|Index Scan using|Index Scan on) (\w+)', ' '.join(_plan(queryset)))
+    return {constraints[name]['columns'][0] for name in indexes if name in constraints}
+
+
+class HotPathIndexTests(TestCase):
+    """The hot lookups of Inventory and FeedSubmissionInfo are served entirely by an index."""
+    def test_lookups_use_indexes(self):
+        store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S', auth_token='t')
+        Inventory.objects.bulk_create([_item(store, 'S%d' % i, sync_status=i % 2, csv_update_number=i % 100)
+                                       for i in range(1000)])
+        lookups = [
+            # Served by the (store, sku) unique index or the sku one, whichever the planner prefers.
+            (Inventory.objects.filter(store=store, sku='S1'), ['sku']),
+            (Inventory.objects.filter(store=store, sync_status=0), ['store_id', 'sync_status']),
+            (Inventory.objects.filter(store=store, csv_update_number=1), ['store_id', 'csv_update_number']),
+            (FeedSubmissionInfo.objects.filter(feed_submission_id='1'), ['feed_submission_id']),
+            (FeedSubmissionInfo.objects.filter(store=store, feed_processing_status='_DONE_'),
+             ['store_id', 'feed_processing_status']),
+        ]
+        for queryset, columns in lookups:
+            indexed = _indexed_conditions(queryset)
+            self.assertTrue(all(column in indexed for column in columns), (columns, indexed))
+
+
+class InventoryStatsTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+
+    def stats(self):
+        return {(stats.sync_status, stats.condition): (stats.items, stats.stock_value)
+                for stats in InventoryStats.objects.filter(store=self.store, items__gt=0)}
+
+    def test_writes_move_items_between_buckets(self):
+        first = _item(self.store, 'S1', cost_price=Decimal('2.50'), quantity=4)
+        first.save()
+        _item(self.store, 'S2', condition='usedgood').save()
+        self.assertEqual(self.stats(), {(0, 'new'): (1, Decimal('10.00')), (0, 'usedgood'): (1, Decimal('1.00'))})
+        first.sync_status = 1
+        first.quantity = 2
+        first.save(update_fields=['sync_status', 'quantity'])
+        self.assertEqual(self.stats(), {(1, 'new'): (1, Decimal('5.00')), (0, 'usedgood'): (1, Decimal('1.00'))})
+        # A feed field changes: the item is pending again.
+        item = Inventory.objects.get(sku='S1')
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.stats(), {(0, 'new'): (1, Decimal('7.50')), (0, 'usedgood'): (1, Decimal('1.00'))})
+        Inventory.objects.get(sku='S2').delete()
+        self.assertEqual(self.stats(), {(0, 'new'): (1, Decimal('7.50'))})
+
+    def test_deferred_items_are_counted_from_the_stored_row(self):
+        _item(self.store, 'S1', quantity=2).save()
+        item = Inventory.objects.only('pk', 'item_name').get(sku='S1')
+        item.item_name = 'renamed'
+        item.save()
+        self.assertEqual(self.stats(), {(0, 'new'): (1, Decimal('2.00'))})
+
+    def test_summary_reads_only_the_buckets(self):
+        other = Store.objects.create(name='B', contact_name='B', email='b@example.com', seller_id='S',
+                                     auth_token='t')
+        for i in range(5):
+            _item(self.store, 'S%d' % i, sync_status=i % 2).save()
+        _item(other, 'S0').save()
+        superuser = get_user_model().objects._create_user('s', 's@example.com', 'pw', is_staff=True,
+                                                          is_superuser=True)
+        with self.assertNumQueries(2):
+            summary = get_inventory_summary(superuser)
+        self.assertEqual([(row['store'].name, row['items'], dict(row['statuses'])) for row in summary],
+                         [('A', 5, {0: 3, 1: 2, 2: 0}), ('B', 1, {0: 1, 1: 0, 2: 0})])
+        user = get_user_model().objects._create_user('a', 'a@example.com', 'pw', store=other, is_staff=True)
+        user.user_permissions.set(Permission.objects.filter(codename='view_inventory'))
+        user = get_user_model().objects.get(pk=user.pk)
+        self.assertEqual([row['store'].name for row in get_inventory_summary(user)], ['B'])
+
+
+class CsvUpdateNumberTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+
+    def test_numbers_advance_in_one_statement(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(next_csv_update_number(self.store.pk), 1)
+        self.assertEqual([next_csv_update_number(self.store.pk) for _ in range(2)], [2, 3])
+        self.store.refresh_from_db()
+        self.assertEqual(self.store.csv_update_number, 3)
+
+    @skipUnless(connection.vendor == 'sqlite', 'RETURNING is only missing from SQLite before 3.35')
+    def test_without_returning(self):
+        with mock.patch.object(connection.Database, 'sqlite_version_info', (3, 34)):
+            self.assertEqual([next_csv_update_number(self.store.pk) for _ in range(2)], [1, 2])
+            self.assertIsNone(next_csv_update_number(uuid.uuid4()))
+
+    def test_unknown_store(self):
+        self.assertIsNone(next_csv_update_number(uuid.uuid4()))
+
+
+class CsvUpdateNumberConcurrencyTests(TransactionTestCase):
+    def test_concurrent_imports_get_distinct_numbers(self):
+        store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                     auth_token='t')
+
+        def advance():
+            try:
+                # Imports take the number in the write lane, as _set_csv_fields does.
+                with write_lane(), transaction.atomic():
+                    return [next_csv_update_number(store.pk) for _ in range(5)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            numbers = [number for batch in executor.map(lambda _: advance(), range(8)) for number in batch]
+        self.assertEqual(sorted(numbers), list(range(1, 41)))
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        self.load('S0,5,10.00', 'S1,5,10.00')
+        self.load('S0,7,10.00', 'S1,5,10.00', 'S2,1,10.00')
+        self.load('S0,8,12.00', 'S1,5,10.00', 'S2,1,10.00')
+
+    def load(self, *items):
+        number = next_csv_update_number(self.store.pk)
+        lines = ['u,%s,v,1.00,1,1,%s,%s,New,1,w' % (sku, price, quantity)
+                 for sku, quantity, price in (item.split(',') for item in items)]
+        _batched_merge(self.store, _rows(*lines), {'csv_filename': 'x.csv', 'csv_datetime': None,
+                                                   'csv_update_number': number})
+
+    def test_inventory_as_of(self):
+        self.assertEqual(inventory_as_of(self.store, 1), {
+            'S0': {'quantity': 5, 'standard_price': Decimal('10.00')},
+            'S2': None,
+        })
+        self.assertEqual(inventory_as_of(self.store, 2, skus=['S0']),
+                         {'S0': {'quantity': 7, 'standard_price': Decimal('10.00')}})
+        self.assertEqual(inventory_as_of(self.store, 3), {})
+
+    def test_rollback_restores_and_feeds_again(self):
+        Inventory.objects.filter(store=self.store).update(sync_status=1)
+        self.assertEqual(rollback_store(self.store, 1), 1)
+        items = {item.sku: item for item in Inventory.objects.filter(store=self.store)}
+        self.assertEqual((items['S0'].quantity, items['S0'].standard_price, items['S0'].sync_status,
+                          items['S0'].csv_update_number), (5, Decimal('10.00'), 0, 4))
+        # Created after import 1: left alone.
+        self.assertEqual((items['S2'].sync_status, items['S2'].csv_update_number), (1, 2))
+        change = InventoryChange.objects.get(store=self.store, csv_update_number=4)
+        self.assertEqual(change.changed_values(), {'quantity': (8, 5),
+                                                   'standard_price': (Decimal('12.00'), Decimal('10.00'))})
+        # Already in that state: nothing to restore.
+        self.assertEqual(rollback_store(self.store, 1), 0)
+
+    def test_rollback_action_confirms_then_feeds(self):
+        superuser = get_user_model().objects._create_user('s', 's@example.com', 'pw', is_staff=True,
+                                                          is_superuser=True)
+        client = Client()
+        client.force_login(superuser)
+        changes = InventoryChange.objects.filter(csv_update_number__gte=2)
+        selected = [str(pk) for pk in changes.values_list('pk', flat=True)]
+        data = {'action': 'rollback_import', helpers.ACTION_CHECKBOX_NAME: selected}
+        response = client.post('/admin/store/inventorychange/', data)
+        self.assertEqual((response.context['csv_update_number'], response.context['sample_skus']), (1, ['S0']))
+        self.assertEqual(Inventory.objects.get(sku='S0').quantity, 8)
+        with mock.patch('store.admin.sync_pending_stores', return_value=[]) as sync:
+            client.post('/admin/store/inventorychange/', dict(data, post='yes'))
+        self.assertEqual(Inventory.objects.get(sku='S0').quantity, 5)
+        sync.assert_called_once_with([self.store])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_PIN_SECONDS=10)
+class ReplicaRouterTests(SimpleTestCase):
+    """Outside TestCase: reads inside a transaction always stay on the primary."""
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def db_for_read(self, request):
+        ReplicaPinMiddleware.process_request(request)
+        thread_local._thread_local.request = request
+        try:
+            return self.router.db_for_read(Inventory)
+        finally:
+            del thread_local._thread_local.request
+            ReplicaPinMiddleware.process_response(request, HttpResponse())
+
+    def test_reads_of_get_requests_go_to_a_replica(self):
+        self.assertEqual(self.db_for_read(self.factory.get('/admin/')), 'replica')
+        self.assertEqual(self.db_for_read(self.factory.post('/admin/')), 'default')
+        self.assertEqual(self.router.db_for_write(Inventory), 'default')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.db_for_read(self.factory.get('/admin/')), 'default')
+
+    def test_confirmation_pages_may_read_from_a_replica(self):
+        request = self.factory.post('/admin/')
+        ReplicaPinMiddleware.process_request(request)
+        thread_local._thread_local.request = request
+        self.addCleanup(delattr, thread_local._thread_local, 'request')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Inventory), 'replica')
+            with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(Inventory), 'default')
+        self.assertEqual(self.router.db_for_read(Inventory), 'default')
+
+    def test_code_outside_requests_reads_from_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Inventory), 'default')
+
+    def test_writes_pin_the_browser_to_the_primary(self):
+        response = ReplicaPinMiddleware.process_response(self.factory.post('/admin/'), HttpResponse())
+        cookie = response.cookies[REPLICA_PIN_COOKIE]
+        self.assertEqual((cookie['max-age'], bool(cookie['httponly'])), (10, True))
+        self.assertGreater(float(cookie.value), time.time() + 9)
+        self.assertNotIn(REPLICA_PIN_COOKIE, ReplicaPinMiddleware.process_response(self.factory.get('/'),
+                                                                                   HttpResponse()).cookies)
+        pinned = self.factory.get('/admin/')
+        pinned.COOKIES[REPLICA_PIN_COOKIE] = cookie.value
+        self.assertEqual(self.db_for_read(pinned), 'default')
+        expired = self.factory.get('/admin/')
+        expired.COOKIES[REPLICA_PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.db_for_read(expired), 'replica')
+        expired.COOKIES[REPLICA_PIN_COOKIE] = 'garbage'
+        self.assertEqual(self.db_for_read(expired), 'replica')
+
+    def test_replicas_are_never_migrated(self):
+        self.assertIs(self.router.allow_migrate('replica', 'store'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'store'))
+
+
+class SeekPaginatorTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        Inventory.objects.bulk_create([_item(self.store, 'S%d' % i) for i in range(7)])
+
+    def pages(self, paginator):
+        return [[item.pk for item in paginator.page(number)] for number in paginator.page_range]
+
+    def test_pages_match_offset_pagination(self):
+        for ordering in ('pk', '-pk'):
+            queryset = Inventory.objects.order_by(ordering)
+            self.assertEqual(self.pages(SeekPaginator(queryset, 3)), self.pages(Paginator(queryset, 3)))
+
+    def test_cursor_seeks_past_the_previous_page(self):
+        queryset = Inventory.objects.order_by('-pk')
+        pks = list(queryset.values_list('pk', flat=True))
+        paginator = SeekPaginator(queryset, 3, cursor=(2, pks[2]))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([item.pk for item in paginator.page(2)], pks[3:6])
+        self.assertFalse([query['sql'] for query in queries.captured_queries if 'OFFSET' in query['sql']])
+
+    def test_large_counts_are_estimated(self):
+        paginator = SeekPaginator(Inventory.objects.order_by('pk'), 3, count_limit=5)
+        # An exact count on SQLite, the planner's guess on PostgreSQL: never below the rows counted.
+        self.assertGreaterEqual(paginator.count, 6)
+        self.assertTrue(paginator.count_is_estimate)
+        paginator = SeekPaginator(Inventory.objects.order_by('pk'), 3, count_limit=10)
+        self.assertEqual((paginator.count, paginator.count_is_estimate), (7, False))
+
+    def test_known_count_is_only_trusted_above_the_limit(self):
+        paginator = SeekPaginator(Inventory.objects.order_by('pk'), 3, count_limit=5, known_count=100)
+        with self.assertNumQueries(0):
+            self.assertEqual((paginator.count, paginator.count_is_estimate), (100, True))
+        # Drifted totals that would fit one page are counted again.
+        paginator = SeekPaginator(Inventory.objects.order_by('pk'), 3, count_limit=10, known_count=0)
+        self.assertEqual((paginator.count, paginator.num_pages), (7, 3))
+
+    def test_drifted_stats_still_paginate_the_changelist(self):
+        InventoryStats.objects.filter(store=self.store).update(items=0)
+        superuser = get_user_model().objects._create_user('s', 's@example.com', 'pw', is_staff=True,
+                                                          is_superuser=True)
+        client = Client()
+        client.force_login(superuser)
+        with mock.patch.object(InventoryAdmin, 'list_per_page', 3):
+            response = client.get('/admin/store/inventory/', {'store__id__exact': self.store.pk})
+        changelist = response.context['cl']
+        self.assertEqual((len(changelist.result_list), changelist.multi_page), (3, True))
+
+
+class CallMwsTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        for i in range(3):
+            _item(self.store, 'S%d' % i).save()
+
+    def stats(self):
+        stats = InventoryStats.objects.filter(store=self.store, items__gt=0)
+        return {bucket.sync_status: bucket.items for bucket in stats}
+
+    def test_items_changed_during_the_call_stay_pending(self):
+        def update_store(store, items, operation):
+            # An upload changes S1 while the feeds are being submitted.
+            item = Inventory.objects.get(store=store, sku='S1')
+            item.quantity = 9
+            item.save()
+            feed = {'FeedSubmissionInfo': {'FeedSubmissionId': {'value': '1'}, 'FeedType': {'value': 'T'},
+                                           'SubmittedDate': {'value': '2026-01-01T00:00:00+00:00'},
+                                           'FeedProcessingStatus': {'value': '_SUBMITTED_'}}}
+            return timezone.now(), feed, None, None
+
+        with mock.patch('store.sync.update_store', update_store):
+            call_mws(self.store, list(Inventory.objects.filter(store=self.store).order_by('sku')), 'update')
+        items = {item.sku: item for item in Inventory.objects.filter(store=self.store)}
+        self.assertEqual({sku: (item.sync_status, item.quantity) for sku, item in items.items()},
+                         {'S0': (1, 1), 'S1': (0, 9), 'S2': (1, 1)})
+        self.assertEqual(self.stats(), {0: 1, 1: 2})
+        self.assertEqual(FeedSubmissionInfo.objects.get(store=self.store).inventory_set.count(), 3)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        Inventory.objects.bulk_create([
+            _item(self.store, 'ABC-1', upc='0001', asin='B001', item_name='Blue cotton shirt'),
+            _item(self.store, 'ABC-2', upc='0002', sku_vendor='V-9', item_name='Red wool scarf'),
+            _item(self.store, 'XYZ-1', upc='1000', item_name='Blue wool hat'),
+        ])
+
+    def search(self, term):
+        return sorted(search_inventory(Inventory.objects.all(), term).values_list('sku', flat=True))
+
+    def test_codes_match_by_prefix(self):
+        self.assertEqual(self.search('ABC'), ['ABC-1', 'ABC-2'])
+        self.assertEqual(self.search('000'), ['ABC-1', 'ABC-2'])
+        self.assertEqual(self.search('B001'), ['ABC-1'])
+        self.assertEqual(self.search('V-9'), ['ABC-2'])
+        self.assertEqual(self.search('BC-1'), [])
+
+    def test_item_name_matches_every_word(self):
+        self.assertEqual(self.search('blue'), ['ABC-1', 'XYZ-1'])
+        self.assertEqual(self.search('wool blue'), ['XYZ-1'])
+
+    def test_item_name_index_follows_changes(self):
+        item = Inventory.objects.get(sku='XYZ-1')
+        item.item_name = 'Green wool hat'
+        item.save()
+        Inventory.objects.filter(sku='ABC-1').delete()
+        self.assertEqual(self.search('blue'), [])
+        self.assertEqual(self.search('green'), ['XYZ-1'])
+
+    def test_code_prefixes_use_an_index(self):
+        # A superuser searches every store: the (store, sku) index cannot serve a sku prefix.
+        Inventory.objects.bulk_create([_item(self.store, 'S%d' % i, upc='u%d' % i) for i in range(1000)])
+        for field in CODE_FIELDS:
+            queryset = Inventory.objects.filter(_code_q(field, 'S1', connection))
+            self.assertIn(field, _leading_index_columns(queryset), field)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the FTS5 index is SQLite only')
+class SearchVacuumTests(TransactionTestCase):
+    def test_vacuum_keeps_item_names_matched(self):
+        store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S', auth_token='t')
+        Inventory.objects.bulk_create([_item(store, 'S%d' % i, item_name='item %d' % i) for i in range(20)])
+        Inventory.objects.filter(sku__in=['S%d' % i for i in range(10)]).delete()
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM')
+        matches = search_inventory(Inventory.objects.all(), '15').values_list('sku', flat=True)
+        self.assertEqual(list(matches), ['S15'])
+
+
+class MergeTestsMixin(object):
+    """The outcome of an import, whichever way ``merge`` writes it."""
+    merge = None
+
+    def setUp(self):
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        self.lines = ['u%d,S%d,v,1.00,1,1,10.00,5,New,1,w' % (i, i) for i in range(3)]
+        self.upcs = self.merge(self.store, _rows(*self.lines), self.upload('one.csv', 1))
+
+    def upload(self, filename, number):
+        return {'csv_filename': filename, 'csv_datetime': None, 'csv_update_number': number}
+
+    def items(self):
+        return {item.sku: item for item in Inventory.objects.filter(store=self.store)}
+
+    def stats(self):
+        return {(stats.sync_status, stats.condition): (stats.items, stats.stock_value)
+                for stats in InventoryStats.objects.filter(store=self.store, items__gt=0)}
+
+    def test_insert(self):
+        self.assertEqual(set(self.upcs), {'u0', 'u1', 'u2'})
+        items = self.items()
+        self.assertEqual(sorted(items), ['S0', 'S1', 'S2'])
+        self.assertEqual({(item.sync_status, item.csv_filename, item.csv_update_number) for item in items.values()},
+                         {(0, 'one.csv', 1)})
+        self.assertEqual(self.stats(), {(0, 'new'): (3, Decimal('15.00'))})
+        self.assertEqual(InventoryChange.objects.filter(store=self.store, created=True).count(), 3)
+
+    def test_update(self):
+        for item in Inventory.objects.filter(store=self.store):
+            item.sync_status = 1
+            item.save()
+        self.lines[0] = 'u0,S0,v,1.00,1,1,10.00,7,New,1,w'
+        self.lines[1] = 'u9,S1,v,2.00,1,1,10.00,5,New,1,w'
+        upcs = self.merge(self.store, _rows(*self.lines), self.upload('two.csv', 2))
+        self.assertEqual(set(upcs), {'u9'})
+        items = self.items()
+        # A feed field changed: fed again. Only the cost price changed: still fed.
+        self.assertEqual((items['S0'].sync_status, items['S0'].quantity, items['S0'].csv_filename), (0, 7, 'two.csv'))
+        self.assertEqual((items['S1'].sync_status, items['S1'].upc, items['S1'].csv_update_number), (1, 'u9', 2))
+        # Unchanged: keeps the stamp of the upload that last changed it.
+        self.assertEqual((items['S2'].sync_status, items['S2'].csv_filename, items['S2'].csv_update_number),
+                         (1, 'one.csv', 1))
+        self.assertEqual(self.stats(), {(0, 'new'): (1, Decimal('7.00')), (1, 'new'): (2, Decimal('15.00'))})
+        changes = InventoryChange.objects.filter(store=self.store, csv_update_number=2)
+        self.assertEqual({change.sku: change.changed_values() for change in changes}, {
+            'S0': {'quantity': (5, 7)},
+            'S1': {'upc': ('u1', 'u9'), 'cost_price': (Decimal('1.00'), Decimal('2.00'))},
+        })
+
+
+class BatchedMergeTests(MergeTestsMixin, TestCase):
+    merge = staticmethod(_batched_merge)
+
+    def test_unchanged_rows_are_not_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.merge(self.store, _rows(*self.lines), self.upload('again.csv', 2))
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if query['sql'].startswith(('UPDATE "store_inventory"', 'INSERT INTO "store_inventory"'))])
+        self.assertEqual({item.csv_filename for item in self.items().values()}, {'one.csv'})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY merge needs PostgreSQL')
+class CopyMergeTests(MergeTestsMixin, TestCase):
+    merge = staticmethod(_copy_merge)
+
+    def test_unchanged_rows_are_not_written(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT sku, ctid::text FROM store_inventory')
+            versions = dict(cursor.fetchall())
+        self.lines[0] = 'u0,S0,v,1.00,1,1,10.00,7,New,1,w'
+        self.merge(self.store, _rows(*self.lines), self.upload('two.csv', 2))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT sku, ctid::text FROM store_inventory')
+            rewritten = {sku for sku, version in cursor.fetchall() if versions[sku] != version}
+        self.assertEqual(rewritten, {'S0'})
+
+
+class PruneUploadsTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        self.files = []
+        for number in range(3):
+            name = csv_storage.save(upload_path(self.store, 'x.csv'), ContentFile(b'upload %d' % number))
+            InventoryUpload.objects.create(store=self.store, csv_filename='x.csv', file=name, sha256='', size=8)
+            self.files.append(name)
+
+    def test_files_are_deleted_on_commit(self):
+        with transaction.atomic():
+            self.assertEqual(prune_uploads(self.store, keep=1), 2)
+            self.assertTrue(all(csv_storage.exists(name) for name in self.files))
+        self.assertEqual([csv_storage.exists(name) for name in self.files], [False, False, True])
+
+    def test_stale_unreferenced_files_are_deleted(self):
+        stale = csv_storage.save(upload_path(self.store, 'x.csv'), ContentFile(b'failed request'))
+        os.utime(csv_storage.path(stale), (0, 0))
+        fresh = csv_storage.save(upload_path(self.store, 'x.csv'), ContentFile(b'upload in progress'))
+        prune_uploads(self.store)
+        self.assertEqual([csv_storage.exists(name) for name in [stale, fresh] + self.files],
+                         [False, True, True, True, True])
+
+    def test_rolled_back_prune_keeps_files(self):
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            prune_uploads(self.store, keep=1)
+            1 / 0
+        self.assertEqual(InventoryUpload.objects.count(), 3)
+        self.assertTrue(all(csv_storage.exists(name) for name in self.files))
+
+
+class UploadViewTests(TestCase):
+    """The Update Inventory form streams uploads to disk only for requests allowed to save them."""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+        self.store = Store.objects.create(name='A', contact_name='A', email='a@example.com', seller_id='S',
+                                          auth_token='t')
+        self.other = Store.objects.create(name='B', contact_name='B', email='b@example.com', seller_id='S',
+                                          auth_token='t')
+        self.user = get_user_model().objects._create_user('a', 'a@example.com', 'pw', store=self.store,
+                                                          is_staff=True)
+        self.user.user_permissions.set(Permission.objects.filter(codename__in=['change_storefile', 'view_storefile']))
+
+    def post(self, client, store_id, data=None):
+        content = ','.join(CSV_COLUMNS) + '\nu1,S1,v,1.00,1,1,10.00,5,New,1,w\n'
+        data = dict(data or {}, csv=SimpleUploadedFile('x.csv', content.encode(), 'text/csv'))
+        return client.post('/admin/store/storefile/%s/change/' % store_id, data)
+
+    def stored_files(self):
+        return sorted(name for directory, dirs, names in os.walk(self.media_root) for name in names)
+
+    def test_anonymous_post_stores_nothing(self):
+        client = Client(enforce_csrf_checks=True)
+        client.cookies['csrftoken'] = 'a' * 64
+        for store_id in (self.store.pk, '6f3c0a4e-0000-4000-8000-000000000000'):
+            response = self.post(client, store_id, {'csrfmiddlewaretoken': 'a' * 64})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_other_store_stores_nothing(self):
+        client = Client()
+        client.force_login(self.user)
+        self.post(client, self.other.pk)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rejected_post_stores_nothing(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        client.cookies['csrftoken'] = 'a' * 32
+        self.assertEqual(self.post(client, self.store.pk, {'csrfmiddlewaretoken': 'b' * 32}).status_code, 403)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_saved_upload_is_stored_once(self):
+        client = Client()
+        client.force_login(self.user)
+        self.assertEqual(self.post(client, self.store.pk).status_code, 302)
+        upload = InventoryUpload.objects.get(store=self.store)
+        self.assertEqual(upload.row_count, 1)
+        self.assertEqual(self.stored_files(), [os.path.basename(upload.file.name)])
+        self.assertEqual(Inventory.objects.filter(store=self.store).count(), 1)
+
+    def test_exported_file_uploads_again(self):
+        client = Client()
+        client.force_login(self.user)
+        self.post(client, self.store.pk)
+        Inventory.objects.filter(store=self.store).update(asin='A1', item_name='Item, "one"')
+        superuser = get_user_model().objects._create_user('s', 's@example.com', 'pw', is_staff=True,
+                                                          is_superuser=True)
+        client.force_login(superuser)
+        response = client.get('/admin/store/store/%s/export/' % self.store.pk)
+        exported = b''.join(response.streaming_content)
+        self.assertEqual(len(exported.splitlines()[0].split(b',')), 14)
+        client.force_login(self.user)
+        csv_file = SimpleUploadedFile('export.csv', exported, 'text/csv')
+        response = client.post('/admin/store/storefile/%s/change/' % self.store.pk, {'csv': csv_file})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(InventoryUpload.objects.filter(store=self.store).count(), 2)
+        self.assertEqual(InventoryChange.objects.filter(store=self.store, csv_update_number=2).count(), 0)
+        item = Inventory.objects.get(store=self.store)
+        self.assertEqual((item.sku, item.quantity, item.condition, item.asin), ('S1', 5, 'new', 'A1'))
+
+    def test_unknown_extra_column_is_rejected(self):
+        client = Client()
+        client.force_login(self.user)
+        content = ','.join(CSV_COLUMNS + ('notes',)) + '\nu1,S1,v,1.00,1,1,10.00,5,New,1,w,x\n'
+        response = client.post('/admin/store/storefile/%s/change/' % self.store.pk,
+                               {'csv': SimpleUploadedFile('x.csv', content.encode(), 'text/csv')})
+        self.assertContains(response, 'Column &quot;notes&quot; is not one of the exported columns')
+        self.assertEqual(self.stored_files(), [])
+
+
+@override_settings(MWS_TRACE_TABLE=True)
+class MwsTraceTests(TestCase):
+    def trace_call(self):
+        return mws_trace.trace_call('GetMatchingProductForId', 'S', time.time(), 0.1, 'ok', 0)
+
+    @skipUnless(connection.vendor == 'sqlite', 'the write lane only serializes SQLite writers')
+    def test_trace_is_stored_after_the_write_lane(self):
+        with write_lane():
+            self.trace_call()
+            self.assertFalse(MwsCall.objects.exists())
+        self.assertEqual(MwsCall.objects.count(), 1)
+
+    def test_failed_trace_write_is_logged(self):
+        with mock.patch.object(MwsCall.objects, 'create', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('store.models', 'ERROR'):
+            self.assertEqual(self.trace_call()['operation'], 'GetMatchingProductForId')
+
+    def test_no_pacing_in_a_write_transaction(self):
+        quota = mws_trace._quotas[('S', 'GetMatchingProductForId')] = mws_trace.Quota()
+        self.addCleanup(mws_trace._quotas.pop, ('S', 'GetMatchingProductForId'))
+        quota.blocked_until = time.time() + 5
+        products_api = MeteredProducts(access_key='k', secret_key='s', account_id='S')
+        with mock.patch('utils.aws.time.sleep') as sleep, self.assertRaises(ThrottlingException), \
+                transaction.atomic():
+            products_api.get_matching_product_for_id('ATVPDKIKX0DER', 'UPC', ['u1'])
+        sleep.assert_not_called()
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(METRICS_DIR=directory, METRICS_TOKEN='secret')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.directory = directory
+        self.counter = metrics.Counter('test_events_total', 'Test events.', ('kind',))
+        self.addCleanup(metrics._metrics.pop, 'test_events_total')
+
+    def test_forked_workers_keep_their_own_totals(self):
+        self.counter.inc(kind='a')
+        metrics.flush(force=True)
+        # A worker forked after the application was imported: new pid, fresh totals.
+        with mock.patch('utils.metrics.os.getpid', return_value=os.getpid() + 1):
+            metrics._reset_after_fork()
+            self.counter.inc(2, kind='a')
+            metrics.flush(force=True)
+            self.assertEqual(len(os.listdir(self.directory)), 2)
+            self.assertIn('test_events_total{kind="a"} 3.0', metrics.exposition())
+
+    def test_histograms_add_up_across_processes(self):
+        histogram = metrics.Histogram('test_seconds', 'Test durations.', (), (1, 10))
+        self.addCleanup(metrics._metrics.pop, 'test_seconds')
+        histogram.observe(0.5)
+        metrics.flush(force=True)
+        with mock.patch('utils.metrics.os.getpid', return_value=os.getpid() + 1):
+            metrics._reset_after_fork()
+            histogram.observe(5)
+            histogram.observe(50)
+            lines = metrics.exposition().splitlines()
+        self.assertEqual([line for line in lines if line.startswith('test_seconds')], [
+            'test_seconds_bucket{le="1"} 1.0', 'test_seconds_bucket{le="10"} 2.0',
+            'test_seconds_bucket{le="+Inf"} 3.0', 'test_seconds_sum 55.5', 'test_seconds_count 3.0'])
+
+    def test_scrapes_need_a_staff_user_or_the_token(self):
+        client = Client()
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret',
+                                    REMOTE_ADDR='10.0.0.1').status_code, 403)
+        client.force_login(get_user_model().objects._create_user('a', 'a@example.com', 'pw', is_staff=True))
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_requests_total counter', response.content)
+
+
+@override_settings(PROFILE_SAMPLE_RATE=0, PROFILE_INTERVAL=0.001, PROFILE_HISTORY_COUNT=2)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.superuser = get_user_model().objects._create_user('s', 's@example.com', 'pw', is_staff=True,
+                                                               is_superuser=True)
+        self.client.force_login(self.superuser)
+
+    def test_superusers_profile_a_request_on_demand(self):
+        response = self.client.get('/admin/store/inventory/', {'_profile': ''})
+        # The flag is not taken for a changelist filter.
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.method, profile.path, profile.view_name, profile.username, profile.status_code),
+                         ('GET', '/admin/store/inventory/?_profile=', 'admin:store_inventory_changelist', 's', 200))
+        self.assertGreater(profile.query_count, 0)
+        self.assertEqual(len(json.loads(profile.queries)), profile.query_count)
+        self.assertGreater(profile.duration, 0)
+
+        self.client.get('/admin/', HTTP_X_PROFILE='1')
+        self.client.get('/admin/', HTTP_X_PROFILE='1')
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        self.assertFalse(RequestProfile.objects.filter(pk=profile.pk).exists())
+
+    def test_other_requests_are_not_profiled(self):
+        self.client.get('/admin/')
+        staff = Client()
+        staff.force_login(get_user_model().objects._create_user('a', 'a@example.com', 'pw', is_staff=True))
+        self.assertEqual(staff.get('/admin/', {'_profile': ''}, HTTP_X_PROFILE='1').status_code, 200)
+        self.assertFalse(RequestProfile.objects.exists())
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            staff.get('/admin/')
+        self.assertEqual(RequestProfile.objects.get().username, 'a')
+
+    def test_stacks_download_for_superusers_only(self):
+        self.client.get('/admin/', HTTP_X_PROFILE='1')
+        profile = RequestProfile.objects.get()
+        response = self.client.get('/admin/store/requestprofile/%s/stacks/' % profile.pk)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response.content.decode(), profile.collapsed_stacks)
+        staff = Client()
+        staff.force_login(get_user_model().objects._create_user('a', 'a@example.com', 'pw', is_staff=True))
+        self.assertEqual(staff.get('/admin/store/requestprofile/%s/stacks/' % profile.pk).status_code, 403)
+
+    def test_sampler_counts_the_stacks_of_its_thread(self):
+        def busy_wait():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = StackSampler(0.001).start()
+        busy_wait()
+        sampler.stop()
+        self.assertGreater(sampler.samples, 0)
+        self.assertEqual(sum(sampler.stacks.values()), sampler.samples)
+        line = sampler.collapsed().splitlines()[0]
+        self.assertRegex(line, r'busy_wait \(tests\.py:\d+\) \d+$')
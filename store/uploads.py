@@ -0,0 +1,103 @@
+import csv
+import gzip
+import io
+import os
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from store.models import Inventory, CSV_COLUMNS, EXPORT_COLUMNS, csv_storage, upload_path
+
+CSV_FIELD = 'csv'
+
+
+class StreamedUpload(UploadedFile):
+    """
+    An inventory CSV file InventoryUploadHandler compressed into a temporary
+    file of ``csv_storage`` as it arrived; reading it decompresses that file.
+    Saving it to ``csv_storage`` moves the file under its content address.
+    """
+    def __init__(self, file, name, size, writer, row_count, header_error=None):
+        super().__init__(file, name, 'text/csv', size)
+        self.writer = writer
+        self.sha256 = writer.sha256.hexdigest() if writer is not None else None
+        self.row_count = row_count
+        self.header_error = header_error
+
+
+def header_error(line):
+    """
+    Why ``line`` is not the header of an inventory CSV file, or None. The
+    CSV_COLUMNS come first and are read by position whatever they are
+    called; any further columns must be the export's, named as it names
+    them, and are ignored.
+    """
+    columns = next(csv.reader([line.decode('utf-8-sig', 'replace')]), [])
+    if not len(CSV_COLUMNS) <= len(columns) <= len(EXPORT_COLUMNS):
+        return 'The file has %(count)d columns, expected %(expected)d.' % {
+            'count': len(columns), 'expected': len(CSV_COLUMNS)}
+    for column, name in zip(columns[len(CSV_COLUMNS):], EXPORT_COLUMNS[len(CSV_COLUMNS):]):
+        verbose_name = Inventory._meta.get_field(name).verbose_name
+        if column.strip().lower() not in (name, verbose_name.lower()):
+            return 'Column "%(column)s" is not one of the exported columns, expected "%(expected)s".' % {
+                'column': column, 'expected': verbose_name}
+    return None
+
+
+class InventoryUploadHandler(FileUploadHandler):
+    """
+    Stream the inventory CSV file of the Update Inventory form straight into
+    a temporary file of ``csv_storage``, compressing it and computing its
+    sha256, row count and header check chunk by chunk, instead of buffering
+    it in a temporary file that is copied and read again when the form is
+    saved. Other files are left to the next handlers. Only install it once
+    the request may change ``store``, and ``discard`` it when the request
+    is done: a file the request did not save is removed then.
+    """
+    def __init__(self, request, store):
+        super().__init__(request)
+        self.store = store
+        self.writer = None
+        self.uploads = []
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.writer = None
+        if field_name == CSV_FIELD and os.path.splitext(file_name)[1].lower() == '.csv':
+            self.writer = csv_storage.writer(upload_path(self.store, file_name))
+            self.header = b''
+            self.lines = 0
+            self.last_byte = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        self.writer.write(raw_data)
+        if self.header is not None and not self.header.endswith(b'\n'):
+            self.header += raw_data[:raw_data.find(b'\n') + 1 or len(raw_data)]
+        self.lines += raw_data.count(b'\n')
+        self.last_byte = raw_data[-1:] or self.last_byte
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        writer, self.writer = self.writer, None
+        error = header_error(self.header)
+        if error is not None:
+            writer.abort()
+            return StreamedUpload(io.BytesIO(), self.file_name, file_size, None, 0, error)
+        writer.finish()
+        lines = self.lines + (1 if self.last_byte not in (b'', b'\n') else 0)
+        upload = StreamedUpload(gzip.open(writer.temporary_path, 'rb'), self.file_name, file_size, writer,
+                                max(lines - 1, 0))
+        self.uploads.append(upload)
+        return upload
+
+    def discard(self):
+        """Remove the files of the request that were not saved, e.g. because its form was invalid."""
+        if self.writer is not None:
+            self.writer.abort()
+        for upload in self.uploads:
+            upload.close()
+            upload.writer.abort()
@@ -1,7 +1,11 @@
 def validate_csv_file_extension(value):
     import os
     from django.core.exceptions import ValidationError
-    ext = os.path.splitext(value.name)[1]  # [0] returns path+filename
+    name = value.name
+    if getattr(value, '_committed', False) and name.endswith('.gz'):
+        # Already stored, compressed, by ContentAddressedStorage.
+        name = name[:-3]
+    ext = os.path.splitext(name)[1]  # [0] returns path+filename
     valid_extensions = ['.csv']
     if not ext.lower() in valid_extensions:
         raise ValidationError('Invalid file .csv only.')
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FEED = 'feed'
+REPORT = 'report'
+
+_OBJECTS_DIR = 'objects'
+_INDEX_DIR = 'index'
+
+
+def _archive_root():
+    return getattr(settings, 'ARCHIVE_ROOT', os.path.join(settings.MEDIA_ROOT, 'archive'))
+
+
+def _compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), 'zst'
+    return gzip.compress(data, compresslevel=6), 'gz'
+
+
+def _decompress(data, ext):
+    if ext == 'zst':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def _index_path(feed_submission_id):
+    return os.path.join(_archive_root(), _INDEX_DIR, '%s.json' % feed_submission_id)
+
+
+def _object_path(key):
+    return os.path.join(_archive_root(), _OBJECTS_DIR, key[:2], key)
+
+
+def _put_object(data):
+    """
+    Store ``data`` under its sha256 digest and return the object key. Identical
+    payloads (e.g. the same price feed re-submitted) are only written once.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    for ext in ('zst', 'gz'):
+        key = '%s.%s' % (digest, ext)
+        if os.path.exists(_object_path(key)):
+            return key
+    compressed, ext = _compress(data)
+    key = '%s.%s' % (digest, ext)
+    _write_atomic(_object_path(key), compressed)
+    return key
+
+
+def _get_object(key):
+    try:
+        with open(_object_path(key), 'rb') as object_file:
+            return _decompress(object_file.read(), key.rsplit('.', 1)[1])
+    except FileNotFoundError:
+        return None
+
+
+def get_index(feed_submission_id):
+    try:
+        with open(_index_path(feed_submission_id), 'r') as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return None
+
+
+def _put(feed_submission_id, kind, data, **extra):
+    entry = get_index(feed_submission_id) or {'feed_submission_id': feed_submission_id,
+                                              'created': time.time()}
+    entry.update(extra)
+    entry[kind] = _put_object(data)
+    entry['%s_size' % kind] = len(data)
+    _write_atomic(_index_path(feed_submission_id), json.dumps(entry).encode('utf-8'))
+    return entry
+
+
+def archive_feed(feed_submission_id, body, feed_type=None, seller_id=None):
+    return _put(feed_submission_id, FEED, body, feed_type=feed_type, seller_id=seller_id)
+
+
+def archive_report(feed_submission_id, content):
+    return _put(feed_submission_id, REPORT, content)
+
+
+def get_feed(feed_submission_id):
+    return _get(feed_submission_id, FEED)
+
+
+def get_report(feed_submission_id):
+    return _get(feed_submission_id, REPORT)
+
+
+def _get(feed_submission_id, kind):
+    entry = get_index(feed_submission_id)
+    if entry is None or kind not in entry:
+        return None
+    return _get_object(entry[kind])
+
+
+def prune(retention_days=None):
+    """
+    Drop index entries older than ``retention_days`` (defaults to
+    ``settings.ARCHIVE_RETENTION_DAYS``) and every object no longer referenced
+    by a remaining entry. Return the number of entries and objects removed.
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'ARCHIVE_RETENTION_DAYS', 180)
+    cutoff = time.time() - retention_days * 86400
+    index_dir = os.path.join(_archive_root(), _INDEX_DIR)
+    objects_dir = os.path.join(_archive_root(), _OBJECTS_DIR)
+    removed_entries = 0
+    removed_objects = 0
+    referenced = set()
+    if os.path.exists(index_dir):
+        for file_name in os.listdir(index_dir):
+            path = os.path.join(index_dir, file_name)
+            try:
+                with open(path, 'r') as index_file:
+                    entry = json.load(index_file)
+            except (OSError, ValueError):
+                continue
+            if entry.get('created', 0) < cutoff:
+                os.remove(path)
+                removed_entries += 1
+            else:
+                referenced.update(entry[kind] for kind in (FEED, REPORT) if kind in entry)
+    if os.path.exists(objects_dir):
+        for root, dirs, files in os.walk(objects_dir):
+            for file_name in files:
+                if file_name not in referenced and not file_name.endswith('.tmp'):
+                    os.remove(os.path.join(root, file_name))
+                    removed_objects += 1
+    return removed_entries, removed_objects
@@ -1,16 +1,20 @@
 import base64
 import hashlib
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.contrib import messages
 from django.http import HttpResponseRedirect
 from django.utils.deprecation import MiddlewareMixin
 from mws import mws, Feeds as FeedsMWS, utils, MWSError
-from mws.mws import calc_md5
+from mws.mws import calc_md5, DictWrapper
 
 from amazonseller.settings import MWS_ACCESS_KEY, MWS_SECRET_KEY
+from utils import archive, metrics, mws_trace
+from utils.db import in_write_transaction
 from utils.helper import mws_normalize_condition
 
 logger = logging.getLogger(__name__)
@@ -67,8 +71,6 @@ def build_product_feed_body(seller_id, items):
                                             'condition': mws_normalize_condition(item.condition)}
                             for index, item in enumerate(items)] +
                            ['</AmazonEnvelope>'])
-    logger.debug('============PRODUCT============')
-    logger.debug(amz_envelope.encode('utf-8'))
     return amz_envelope.encode('utf-8')
 
 
@@ -90,8 +92,6 @@ def build_product_delete_feed_body(seller_id, items):
                             '</Message>' % {'index': (index + 1),
                                             'sku': item.sku} for index, item in enumerate(items)] +
                            ['</AmazonEnvelope>'])
-    logger.debug('============PRODUCT DELETE============')
-    logger.debug(amz_envelope.encode('utf-8'))
     return amz_envelope.encode('utf-8')
 
 
@@ -114,8 +114,6 @@ def build_price_feed_body(seller_id, items):
                                             'sku': item.sku,
                                             'price': item.standard_price} for index, item in enumerate(items)] +
                            ['</AmazonEnvelope>'])
-    logger.debug('============PRICE============')
-    logger.debug(amz_envelope.encode('utf-8'))
     return amz_envelope.encode('utf-8')
 
 
@@ -146,11 +144,61 @@ def build_inventory_feed_body(seller_id, items):
                                             'handling': get_item_handling_time(item)}
                             for index, item in enumerate(items)] +
                            ['</AmazonEnvelope>'])
-    logger.debug('============INVENTORY============')
-    logger.debug(amz_envelope.encode('utf-8'))
     return amz_envelope.encode('utf-8')
 
 
+class MeteredMixin(object):
+    """
+    Trace every MWS call (utils.mws_trace) and count and time it in
+    utils.metrics, by operation and seller, telling throttled calls apart.
+    Calls are paced by the quota MWS last reported: they wait for it when
+    the wait is at most MWS_MAX_PACE_SECONDS and no write transaction is
+    open, and raise ThrottlingException otherwise.
+    """
+    def make_request(self, extra_data, method="GET", **kwargs):
+        operation = extra_data.get('Action', 'unknown')
+        delay = mws_trace.pace_delay(self.account_id, operation)
+        # No waiting with a write transaction open: its locks would hold up every other writer meanwhile.
+        if delay > settings.MWS_MAX_PACE_SECONDS or delay and in_write_transaction():
+            raise ThrottlingException('Throttling: %(operation)s quota of seller %(seller)s used up, %(minutes)d '
+                                      'minute(s) remaining' % {'operation': operation, 'seller': self.account_id,
+                                                               'minutes': delay // 60})
+        if delay:
+            time.sleep(delay)
+        outcome = 'error'
+        response = None
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            parsed_response = super(MeteredMixin, self).make_request(extra_data, method, **kwargs)
+            response = parsed_response.response
+            outcome = 'ok'
+            return parsed_response
+        except MWSError as e:
+            response = getattr(e, 'response', None)
+            if getattr(response, 'status_code', None) == 503 and 'RequestThrottled' in str(e):
+                outcome = 'throttled'
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            mws_trace.trace_call(operation, self.account_id, started, duration, outcome,
+                                 len(kwargs.get('body') or ''), response)
+            metrics.MWS_LATENCY.observe(duration, operation=operation, seller_id=self.account_id)
+            metrics.MWS_REQUESTS.inc(operation=operation, seller_id=self.account_id, outcome=outcome)
+
+
+class MeteredFeeds(MeteredMixin, mws.Feeds):
+    pass
+
+
+class MeteredProducts(MeteredMixin, mws.Products):
+    pass
+
+
+class MeteredInventory(MeteredMixin, mws.Inventory):
+    pass
+
+
 class ThrottlingException(Exception):
     def __init__(self, *args):
         Exception.__init__(self, *args)
@@ -161,30 +209,42 @@ class DataCorruptionException(Exception):
         Exception.__init__(self, *args)
 
 
+def submit_feed(feeds_api, seller_id, body, feed_type):
+    feed_return = feeds_api.submit_feed(body, feed_type)
+    try:
+        feed_submission_id = feed_return.parsed['FeedSubmissionInfo']['FeedSubmissionId']['value']
+        archive.archive_feed(feed_submission_id, body, feed_type=feed_type, seller_id=seller_id)
+    except (KeyError, TypeError, OSError) as e:
+        logger.error('Unable to archive %(feed_type)s feed body: %(error)s' % {'feed_type': feed_type, 'error': e})
+    return feed_return
+
+
 def update_store(store, items, operation='update'):
     seller_id = store.seller_id
     auth_token = store.auth_token
     store_last_execution = store.last_execution
     store_name = store.name
-    feeds_api = mws.Feeds(access_key=MWS_ACCESS_KEY,
-                          secret_key=MWS_SECRET_KEY,
-                          account_id=seller_id,
-                          auth_token=auth_token)
+    feeds_api = MeteredFeeds(access_key=MWS_ACCESS_KEY,
+                             secret_key=MWS_SECRET_KEY,
+                             account_id=seller_id,
+                             auth_token=auth_token)
     # NO THROTTLING -> MINUTES=0
     if store_last_execution is None or datetime.now(tz=timezone.utc) >= (store_last_execution + timedelta(minutes=0)):
         if operation == 'update':
-            product_return = feeds_api.submit_feed(build_product_feed_body(seller_id, items), '_POST_PRODUCT_DATA_')
-            price_return = feeds_api.submit_feed(build_price_feed_body(seller_id, items), '_POST_PRODUCT_PRICING_DATA_')
-            inventory_return = feeds_api.submit_feed(build_inventory_feed_body(seller_id, items),
-                                                     '_POST_INVENTORY_AVAILABILITY_DATA_')
+            product_return = submit_feed(feeds_api, seller_id, build_product_feed_body(seller_id, items),
+                                         '_POST_PRODUCT_DATA_')
+            price_return = submit_feed(feeds_api, seller_id, build_price_feed_body(seller_id, items),
+                                       '_POST_PRODUCT_PRICING_DATA_')
+            inventory_return = submit_feed(feeds_api, seller_id, build_inventory_feed_body(seller_id, items),
+                                           '_POST_INVENTORY_AVAILABILITY_DATA_')
             # logger.info(product_return.response.headers)
             # logger.info(price_return.response.headers)
             # logger.info(inventory_return.response.headers)
             return datetime.now(tz=timezone.utc), product_return.parsed, price_return.parsed, inventory_return.parsed
             # SAVE DATETIME NOW FOR THE 20 MINUTES CHECK
         elif operation == 'delete':
-            product_return = feeds_api.submit_feed(build_product_delete_feed_body(seller_id, items),
-                                                   '_POST_PRODUCT_DATA_')
+            product_return = submit_feed(feeds_api, seller_id, build_product_delete_feed_body(seller_id, items),
+                                         '_POST_PRODUCT_DATA_')
             return datetime.now(tz=timezone.utc), product_return.parsed, None, None
     else:
         time_left = (store_last_execution + timedelta(minutes=20)) - datetime.now(tz=timezone.utc)
@@ -194,10 +254,10 @@ def update_store(store, items, operation='update'):
 
 
 def store_inventory(seller_id, auth_token):
-    inventory_api3 = mws.Inventory(access_key=MWS_ACCESS_KEY,  # INFO NOSSA (24U/Idea Shop)
-                                   secret_key=MWS_SECRET_KEY,  # INFO NOSSA (24U/Idea Shop)
-                                   account_id=seller_id,  # INFO LOJA (Seller ID)
-                                   auth_token=auth_token)  # INFO LOJA
+    inventory_api3 = MeteredInventory(access_key=MWS_ACCESS_KEY,  # INFO NOSSA (24U/Idea Shop)
+                                      secret_key=MWS_SECRET_KEY,  # INFO NOSSA (24U/Idea Shop)
+                                      account_id=seller_id,  # INFO LOJA (Seller ID)
+                                      auth_token=auth_token)  # INFO LOJA
     date = datetime.now()
     date = date + relativedelta(days=-1)
     inventory_list = inventory_api3.list_inventory_supply(datetime_=date.isoformat())
@@ -208,19 +268,19 @@ def store_inventory(seller_id, auth_token):
 
 
 def get_items(seller_id, auth_token, items):
-    products_api = mws.Products(access_key=MWS_ACCESS_KEY,  # INFO NOSSA (24U/Idea Shop)
-                                secret_key=MWS_SECRET_KEY,  # INFO NOSSA (24U/Idea Shop)
-                                account_id=seller_id,  # INFO LOJA (Seller ID)
-                                auth_token=auth_token)  # INFO LOJA
+    products_api = MeteredProducts(access_key=MWS_ACCESS_KEY,  # INFO NOSSA (24U/Idea Shop)
+                                   secret_key=MWS_SECRET_KEY,  # INFO NOSSA (24U/Idea Shop)
+                                   account_id=seller_id,  # INFO LOJA (Seller ID)
+                                   auth_token=auth_token)  # INFO LOJA
     products = products_api.get_matching_product_for_id('ATVPDKIKX0DER', 'UPC', items)
     return products
 
 
 def get_feed_submission_list(seller_id, auth_token, feed_ids):
-    feeds_api = mws.Feeds(access_key=MWS_ACCESS_KEY,
-                          secret_key=MWS_SECRET_KEY,
-                          account_id=seller_id,
-                          auth_token=auth_token)
+    feeds_api = MeteredFeeds(access_key=MWS_ACCESS_KEY,
+                             secret_key=MWS_SECRET_KEY,
+                             account_id=seller_id,
+                             auth_token=auth_token)
     feed_submission_return = feeds_api.get_feed_submission_list(feedids=feed_ids,
                                                                 feedtypes=['_POST_PRODUCT_DATA_',
                                                                            '_POST_PRODUCT_PRICING_DATA_',
@@ -232,11 +292,14 @@ def get_feed_submission_list(seller_id, auth_token, feed_ids):
     return feed_submission_return.parsed['FeedSubmissionInfo']
 
 
-def get_feed_submission_result(seller_id, auth_token, feed_id):
-    feeds_api = mws.Feeds(access_key=MWS_ACCESS_KEY,
-                          secret_key=MWS_SECRET_KEY,
-                          account_id=seller_id,
-                          auth_token=auth_token)
+def download_feed_submission_result(seller_id, auth_token, feed_id):
+    archived_report = archive.get_report(feed_id)
+    if archived_report is not None:
+        return DictWrapper(archived_report.decode('utf-8'), 'Message')
+    feeds_api = MeteredFeeds(access_key=MWS_ACCESS_KEY,
+                             secret_key=MWS_SECRET_KEY,
+                             account_id=seller_id,
+                             auth_token=auth_token)
     feed_submission_result_return = feeds_api.get_feed_submission_result(feed_id)
     content_md5 = calc_md5(feed_submission_result_return.response.content).decode('utf-8')
     if feed_submission_result_return.response.headers['Content-MD5'] != content_md5:
@@ -246,6 +309,15 @@ def get_feed_submission_result(seller_id, auth_token, feed_id):
                      {'header_md5': feed_submission_result_return.response.headers['Content-MD5'],
                       'content_md5': content_md5})
         raise DataCorruptionException()
+    try:
+        archive.archive_report(feed_id, feed_submission_result_return.response.content)
+    except OSError as e:
+        logger.error('Unable to archive processing report %(feed_id)s: %(error)s' % {'feed_id': feed_id, 'error': e})
+    return feed_submission_result_return
+
+
+def get_feed_submission_result(seller_id, auth_token, feed_id):
+    feed_submission_result_return = download_feed_submission_result(seller_id, auth_token, feed_id)
     processing_report = feed_submission_result_return.parsed['ProcessingReport']
     result_status = ['_DONE_']
     log_result = False
@@ -266,7 +338,8 @@ def get_feed_submission_result(seller_id, auth_token, feed_id):
             log_result = True
             result_status.append('_WITH_WARNING_')
     if log_result:
-        logger.error(feed_submission_result_return.original)
+        logger.error('Feed %(feed_id)s processed with status %(status)s, see its archived processing report' %
+                     {'feed_id': feed_id, 'status': ''.join(result_status)})
     return ''.join(result_status)
 
 
@@ -285,6 +358,10 @@ class HandleBusinessExceptionMiddleware(MiddlewareMixin):
             messages.error(request, message)
             logger.error(exception)
             return RedirectToRefererResponse(request)
+        if isinstance(exception, ThrottlingException):
+            messages.error(request, str(exception))
+            logger.error(exception)
+            return RedirectToRefererResponse(request)
         if isinstance(exception, ConnectionError):
             message = 'Amazon was unable to process your action, please check the logs for more details.'
             messages.error(request, message)
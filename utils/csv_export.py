@@ -0,0 +1,25 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+
+class Echo(object):
+    """
+    File-like object whose ``write`` hands the row back instead of storing it,
+    so ``csv.writer`` can feed a ``StreamingHttpResponse`` row by row.
+    """
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(filename, header, rows):
+    writer = csv.writer(Echo())
+
+    def stream():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
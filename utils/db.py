@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils.deprecation import MiddlewareMixin
+
+from utils.thread_local import get_current_request
+
+try:
+    import fcntl
+except ImportError:  # Windows: the write lane only serializes threads
+    fcntl = None
+
+_write_lane_lock = threading.Lock()
+_write_lane_local = threading.local()
+_replica_local = threading.local()
+
+REPLICA_PIN_COOKIE = 'db_pin'
+
+
+def chunked_queryset(queryset, chunk_size=1000):
+    """
+    Yield ``queryset`` as lists of at most ``chunk_size`` objects, walking the
+    primary key index (``WHERE pk > last ORDER BY pk LIMIT n``) instead of
+    using OFFSET, so every chunk costs the same however deep it is.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    ``connection_created`` receiver applying settings.SQLITE_PRAGMAS (WAL
+    journal, synchronous=NORMAL, cache and mmap sizes, busy timeout) to every
+    new SQLite connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@contextmanager
+def write_lane(using=DEFAULT_DB_ALIAS):
+    """
+    Run a bulk writer in the single SQLite write lane: one bulk writer at a
+    time across threads and, through a lock file next to the database, across
+    processes. Other writers keep their short autocommit writes and readers
+    are never blocked under WAL. Re-entrant; a no-op on other databases.
+    Take it before the transaction's first write: SQLite holds its write lock
+    from that write until the commit, whatever the lane does.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or getattr(_write_lane_local, 'held', False):
+        yield
+        return
+    name = str(connection.settings_dict['NAME'])
+    lock_path = None if fcntl is None or name == ':memory:' or name.startswith('file:') else name + '.write-lane'
+    _write_lane_local.deferred = []
+    try:
+        with _write_lane_lock:
+            _write_lane_local.held = True
+            try:
+                if lock_path is None:
+                    yield
+                else:
+                    with open(lock_path, 'a') as lock_file:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                        try:
+                            yield
+                        finally:
+                            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                _write_lane_local.held = False
+    finally:
+        deferred, _write_lane_local.deferred = _write_lane_local.deferred, []
+        for func in deferred:
+            func()
+
+
+def after_write_lane(func):
+    """
+    Call ``func`` once this thread leaves the write lane, or now outside of
+    it: slow work such as MWS calls never holds up the other bulk writers.
+    """
+    if getattr(_write_lane_local, 'held', False):
+        _write_lane_local.deferred.append(func)
+    else:
+        func()
+
+
+def in_write_transaction(using=DEFAULT_DB_ALIAS):
+    """Whether this thread holds the write lane or is inside a transaction that may hold write locks."""
+    return getattr(_write_lane_local, 'held', False) or connections[using].in_atomic_block
+
+
+@contextmanager
+def replica_reads():
+    """
+    Let the reads of a POST request that only shows data, like an action
+    confirmation page, go to a replica as GET requests do.
+    """
+    previous = getattr(_replica_local, 'allowed', False)
+    _replica_local.allowed = True
+    try:
+        yield
+    finally:
+        _replica_local.allowed = previous
+
+
+def _reads_from_replica():
+    if not settings.DATABASE_REPLICAS or getattr(_replica_local, 'pinned', True):
+        return False
+    if getattr(_write_lane_local, 'held', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return False
+    return get_current_request().method in ('GET', 'HEAD') or getattr(_replica_local, 'allowed', False)
+
+
+class ReplicaRouter(object):
+    """
+    Send the reads of read-only admin requests to one of
+    settings.DATABASE_REPLICAS. Writes, reads inside a transaction or the
+    write lane, requests that are not GET/HEAD, code running outside a
+    request (sync workers, commands) and browsers that wrote in the last
+    DATABASE_REPLICA_PIN_SECONDS all use the primary.
+    """
+    def db_for_read(self, model, **hints):
+        if _reads_from_replica():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        return obj1._state.db in aliases and obj2._state.db in aliases or None
+
+    def allow_migrate(self, db, app_label, **hints):
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """
+    Read-your-writes for ReplicaRouter: every request that is not GET/HEAD
+    pins its browser to the primary for DATABASE_REPLICA_PIN_SECONDS through
+    a cookie, so replica lag never hides the user's own changes.
+    """
+    @staticmethod
+    def process_request(request):
+        try:
+            pinned_until = float(request.COOKIES.get(REPLICA_PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        _replica_local.pinned = pinned_until > time.time()
+
+    @staticmethod
+    def process_response(request, response):
+        if settings.DATABASE_REPLICAS and request.method not in ('GET', 'HEAD'):
+            seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+            response.set_cookie(REPLICA_PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds, httponly=True)
+        _replica_local.pinned = True
+        return response
@@ -0,0 +1,250 @@
+import atexit
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+
+_lock = threading.Lock()
+_metrics = {}
+# One file per process, named on its first flush: see _process_file_name.
+_process_file = None
+_process_pid = None
+_last_flush = 0.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+MWS_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _metrics[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Counter):
+    """Per label set: ``[count in each bucket (not cumulative) and above the last, sum]``."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with _lock:
+            observations = self.values.get(key)
+            if observations is None:
+                observations = self.values[key] = [[0] * (len(self.buckets) + 1), 0]
+            observations[0][index] += 1
+            observations[1] += value
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by view, method and status.', ('view', 'method', 'status'))
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time spent answering a request, by view.',
+                            ('view',), LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('db_queries_per_request', 'Database queries run by a request, by view.',
+                            ('view',), QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_TIME = Histogram('db_query_seconds_per_request', 'Time a request spent in database queries, by view.',
+                               ('view',), LATENCY_BUCKETS)
+MWS_REQUESTS = Counter('mws_requests_total', 'MWS calls by operation, seller and outcome (ok, error, throttled).',
+                       ('operation', 'seller_id', 'outcome'))
+MWS_LATENCY = Histogram('mws_request_duration_seconds', 'MWS call latency by operation and seller.',
+                        ('operation', 'seller_id'), MWS_LATENCY_BUCKETS)
+
+
+def _snapshot():
+    with _lock:
+        return {name: [[list(key), value if metric.type == 'counter' else [list(value[0]), value[1]]]
+                       for key, value in metric.values.items()]
+                for name, metric in _metrics.items()}
+
+
+def _process_file_name():
+    """
+    This process's file: pid plus the time it was named, so a recycled pid
+    never overwrites a dead worker's totals. Named again whenever the pid
+    changes, as workers forked from a server that imported the application
+    first (gunicorn --preload) would otherwise all share their parent's.
+    """
+    global _process_file, _process_pid
+    pid = os.getpid()
+    if pid != _process_pid:
+        _process_file = '%d-%d.json' % (pid, time.time() * 1000)
+        _process_pid = pid
+    return _process_file
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero: what its parent counted stays in the parent's file.
+    global _lock, _last_flush
+    _lock = threading.Lock()
+    _last_flush = 0.0
+    for metric in _metrics.values():
+        metric.values = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def flush(force=False):
+    """
+    Write this process's totals to its file in settings.METRICS_DIR, at most
+    every METRICS_FLUSH_INTERVAL seconds unless ``force``d, so that any
+    worker's /metrics can add up every worker's totals.
+    """
+    global _last_flush
+    directory = getattr(settings, 'METRICS_DIR', None)
+    now = time.monotonic()
+    if not directory or (not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL):
+        return
+    _last_flush = now
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    with os.fdopen(fd, 'w') as tmp_file:
+        json.dump(_snapshot(), tmp_file)
+    os.replace(tmp_path, os.path.join(directory, _process_file_name()))
+
+
+atexit.register(flush, True)
+
+
+def _collect():
+    """Totals of every process: the files in METRICS_DIR, or this process alone without one."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return [_snapshot()]
+    flush(force=True)
+    snapshots = []
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, file_name)) as metrics_file:
+                    snapshots.append(json.load(metrics_file))
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                          .replace('\n', r'\n')) for name, value in pairs)
+
+
+def exposition():
+    """All metrics, summed over the processes, in the Prometheus text format."""
+    totals = {name: {} for name in _metrics}
+    for snapshot in _collect():
+        for name, samples in snapshot.items():
+            metric = _metrics.get(name)
+            if metric is None:
+                continue
+            for key, value in samples:
+                key = tuple(key)
+                if metric.type == 'counter':
+                    totals[name][key] = totals[name].get(key, 0) + value
+                else:
+                    total = totals[name].setdefault(key, [[0] * (len(metric.buckets) + 1), 0])
+                    total[0] = [a + b for a, b in zip(total[0], value[0])]
+                    total[1] += value[1]
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append('# HELP %s %s' % (name, metric.documentation))
+        lines.append('# TYPE %s %s' % (name, metric.type))
+        for key, value in sorted(totals[name].items()):
+            if metric.type == 'counter':
+                lines.append('%s%s %s' % (name, _labels(metric.labelnames, key), float(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value[0]):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (name, _labels(metric.labelnames, key, [('le', bound)]),
+                                                 float(cumulative)))
+            lines.append('%s_sum%s %s' % (name, _labels(metric.labelnames, key), float(value[1])))
+            lines.append('%s_count%s %s' % (name, _labels(metric.labelnames, key), float(cumulative)))
+    return '\n'.join(lines) + '\n'
+
+
+def _scrape_allowed(request):
+    """
+    Staff users or a scraper sending settings.METRICS_TOKEN as a bearer
+    token, from METRICS_ALLOWED_IPS: behind a local reverse proxy every
+    request comes from 127.0.0.1, so the address alone is not enough.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return False
+    if request.user.is_active and request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(authorization.encode('utf-8'), ('Bearer %s' % token).encode('utf-8'))
+
+
+def metrics_view(request):
+    if not _scrape_allowed(request):
+        raise PermissionDenied
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class _QueryTimer(object):
+    """``execute_wrapper`` counting and timing the queries of one request."""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware(object):
+    """
+    Record each request's latency, status and database queries (count and
+    time, across every database alias) under its URL name.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_LATENCY.observe(elapsed, view=view)
+        REQUEST_QUERIES.observe(timer.count, view=view)
+        REQUEST_QUERY_TIME.observe(timer.seconds, view=view)
+        flush()
+        return response
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from dateutil.parser import isoparse
+from django.conf import settings
+from django.dispatch import Signal
+
+# Sent with the trace of every MWS call, e.g. to store it (see store.models._record_mws_call).
+mws_call = Signal(providing_args=['trace'])
+
+_lock = threading.Lock()
+_calls = None
+_quotas = {}
+
+
+class Quota(object):
+    """The last quota MWS reported for one seller and operation, as seen by this process."""
+    def __init__(self):
+        self.max = None
+        self.remaining = None
+        self.resets_on = None
+        self.last_call = 0.0
+        self.blocked_until = 0.0
+
+
+def _header(headers, name, parse=float):
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return parse(value)
+    except ValueError:
+        return None
+
+
+def trace_call(operation, seller_id, started, duration, outcome, request_bytes, response=None):
+    """
+    Record one MWS call: its trace goes to the ring buffer of the last
+    MWS_TRACE_BUFFER_SIZE calls and to the mws_call signal, and its quota
+    headers (x-mws-quota-max, -remaining, -resetsOn) update the seller's
+    Quota for that operation. A throttled call blocks the operation for
+    MWS_THROTTLE_BACKOFF seconds. Return the trace.
+    """
+    global _calls
+    headers = getattr(response, 'headers', None)
+    trace = {
+        'date': datetime.fromtimestamp(started, tz=timezone.utc),
+        'operation': operation,
+        'seller_id': seller_id,
+        'duration': duration,
+        'outcome': outcome,
+        'status_code': getattr(response, 'status_code', None),
+        'request_bytes': request_bytes,
+        'response_bytes': len(response.content) if response is not None and response.content else 0,
+        'quota_max': _header(headers, 'x-mws-quota-max'),
+        'quota_remaining': _header(headers, 'x-mws-quota-remaining'),
+        'quota_resets_on': _header(headers, 'x-mws-quota-resetsOn', isoparse),
+        'request_id': (headers or {}).get('x-mws-request-id', ''),
+    }
+    now = time.time()
+    with _lock:
+        if _calls is None:
+            _calls = deque(maxlen=settings.MWS_TRACE_BUFFER_SIZE)
+        _calls.append(trace)
+        quota = _quotas.setdefault((seller_id, operation), Quota())
+        quota.last_call = now
+        if trace['quota_remaining'] is not None:
+            quota.max = trace['quota_max']
+            quota.remaining = trace['quota_remaining']
+            quota.resets_on = trace['quota_resets_on'].timestamp() if trace['quota_resets_on'] else None
+        if outcome == 'throttled':
+            quota.blocked_until = now + settings.MWS_THROTTLE_BACKOFF
+    mws_call.send(sender=None, trace=trace)
+    return trace
+
+
+def recent_calls():
+    """The traces in the ring buffer of this process, oldest first."""
+    with _lock:
+        return list(_calls or ())
+
+
+def pace_delay(seller_id, operation):
+    """
+    Seconds to wait before calling ``operation`` for ``seller_id``: until the
+    reset when its quota is used up, or enough to spread the remaining calls
+    evenly until the reset once less than MWS_QUOTA_PACE_BELOW of the quota
+    is left, or until the end of a throttling backoff.
+    """
+    with _lock:
+        quota = _quotas.get((seller_id, operation))
+        if quota is None:
+            return 0
+        now = time.time()
+        delay = quota.blocked_until - now
+        if quota.remaining is not None and quota.resets_on is not None and quota.resets_on > now:
+            if quota.remaining <= 0:
+                delay = max(delay, quota.resets_on - now)
+            elif quota.max and quota.remaining < quota.max * settings.MWS_QUOTA_PACE_BELOW:
+                delay = max(delay, quota.last_call + (quota.resets_on - now) / quota.remaining - now)
+        return max(delay, 0)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, EmptyPage
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset):
+    """
+    Cheap row count for a large queryset: the planner's estimate on
+    PostgreSQL, otherwise an exact count cached for ADMIN_COUNT_CACHE_TIMEOUT
+    seconds.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    key = 'count:%s' % hashlib.md5(('%s %r' % (sql, params)).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.ADMIN_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class SeekPaginator(Paginator):
+    """
+    Paginator for querysets ordered by primary key only (the admin default).
+
+    Pages are read by seeking on the primary key index: with the last key of
+    the previous page as ``cursor`` a page is a plain ``WHERE pk < cursor
+    LIMIT n``. Without a cursor the first key of the page is looked up on the
+    index alone and the page is read from there, so deep pages never make the
+    database read and discard the full rows of every page before them. Any
+    other ordering falls back to the regular OFFSET pagination.
+
+    With ``count_limit`` only the first ``count_limit + 1`` rows are counted;
+    larger results get an ``estimated_count`` and ``count_is_estimate`` is set.
+    A ``known_count`` (e.g. from maintained totals) replaces that estimate.
+    Maintained totals can drift, so it is only taken as such an estimate:
+    above ``count_limit``, and never to decide that the rows fit one page.
+    """
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, cursor=None,
+                 count_limit=None, known_count=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        # (page number, last primary key of the page before it)
+        self.cursor = cursor
+        self.count_limit = count_limit
+        self.known_count = known_count
+        self.count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None and (self.count_limit is None or self.known_count > self.count_limit) \
+                and self.known_count > self.per_page:
+            self.count_is_estimate = True
+            return self.known_count
+        if self.count_limit is None:
+            return super().count
+        count = self.object_list.order_by()[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count
+        self.count_is_estimate = True
+        return max(estimated_count(self.object_list), count)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # An estimated count may fall short of the real one, so pages past it stay reachable.
+            if self.count_is_estimate and int(number) > 1:
+                return int(number)
+            raise
+
+    def _seek_direction(self):
+        pk_names = ('pk', self.object_list.model._meta.pk.name)
+        order_by = tuple(self.object_list.query.order_by)
+        if len(order_by) != 1:
+            return None
+        if order_by[0] in pk_names:
+            return 'gt'
+        if order_by[0].startswith('-') and order_by[0][1:] in pk_names:
+            return 'lt'
+        return None
+
+    def page(self, number):
+        direction = self._seek_direction()
+        if direction is None:
+            return super().page(number)
+        number = self.validate_number(number)
+        if self.cursor is not None and self.cursor[0] == number:
+            object_list = self.object_list.filter(**{'pk__%s' % direction: self.cursor[1]})
+        elif number == 1:
+            object_list = self.object_list
+        else:
+            bottom = (number - 1) * self.per_page
+            first_pk = list(self.object_list.values_list('pk', flat=True)[bottom:bottom + 1])
+            object_list = self.object_list.filter(**{'pk__%se' % direction: first_pk[0]}) if first_pk \
+                else self.object_list.none()
+        return self._get_page(list(object_list[:self.per_page]), number, self)
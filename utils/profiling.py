@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class StackSampler(object):
+    """
+    Sampling profiler for one thread: a daemon thread looks at the target
+    thread's stack every ``interval`` seconds and counts the stacks it sees.
+    The target never runs any profiling code, so the overhead is the
+    sampler's own, roughly constant per sample.
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            del frame
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """The samples in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        return '\n'.join('%s %d' % (';'.join(name.replace(';', ':') for name in stack), count)
+                         for stack, count in self.stacks.most_common())
+
+
+class QueryLog(object):
+    """``execute_wrapper`` keeping the SQL, parameters and duration of up to ``limit`` queries."""
+    def __init__(self, limit=1000):
+        self.limit = limit
+        self.queries = []
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.seconds += duration
+            if len(self.queries) < self.limit:
+                self.queries.append({'sql': sql, 'params': repr(params)[:1000], 'many': many,
+                                     'alias': context['connection'].alias, 'seconds': round(duration, 6)})
@@ -1,4 +1,7 @@
+import gzip
+import hashlib
 import shutil
+import tempfile
 
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
@@ -11,6 +14,100 @@ class OverWriteStorage(FileSystemStorage):
         return name
 
 
+# Files a ContentWriter is still writing, or that a failed request left behind.
+TEMPORARY_SUFFIX = '.tmp'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store each file gzip-compressed under the sha256 of its content, in the
+    directory ``upload_to`` chose: ``<dir>/<sha256>.csv.gz``. Saving content
+    that is already stored only returns the existing name, and no earlier
+    file is ever overwritten or removed.
+    """
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def writer(self, name):
+        """A ContentWriter storing what is written to it like ``save(name, ...)`` would."""
+        return ContentWriter(self, name)
+
+    def _save(self, name, content):
+        writer = getattr(content, 'writer', None)
+        if writer is not None:
+            # Already streamed into a temporary file here, e.g. by store.uploads.InventoryUploadHandler.
+            return writer.close()
+        writer = self.writer(name)
+        try:
+            for chunk in content.chunks():
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+
+class ContentWriter(object):
+    """
+    Incremental writer of a ContentAddressedStorage: compresses and hashes
+    chunks into a temporary file next to their final place. ``finish``
+    completes that file, which stays readable at ``temporary_path`` until
+    ``close`` moves it under its content address and returns the stored
+    name, or ``abort`` removes it.
+    """
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        directory = storage.path(os.path.dirname(name))
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temporary_path = tempfile.mkstemp(suffix=TEMPORARY_SUFFIX, dir=directory)
+        self._file = gzip.GzipFile(fileobj=os.fdopen(fd, 'wb'), mode='wb', compresslevel=6)
+
+    def write(self, chunk):
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        self._file.write(chunk)
+
+    def finish(self):
+        if self._file.fileobj is not None:
+            fileobj = self._file.fileobj
+            self._file.close()
+            fileobj.close()
+
+    def close(self):
+        self.finish()
+        name = os.path.join(os.path.dirname(self.name), '%s%s.gz' % (self.sha256.hexdigest(),
+                                                                     os.path.splitext(self.name)[1]))
+        if self.storage.exists(name):
+            os.remove(self.temporary_path)
+            # Fresh again: store.models.prune_uploads only sweeps unreferenced files once they are stale.
+            os.utime(self.storage.path(name))
+        else:
+            # mkstemp creates the file 0600; stored files get the storage's usual mode.
+            os.chmod(self.temporary_path, self.storage.file_permissions_mode or 0o644)
+            os.replace(self.temporary_path, self.storage.path(name))
+        self.temporary_path = None
+        return name
+
+    def abort(self):
+        self.finish()
+        if self.temporary_path is not None:
+            os.remove(self.temporary_path)
+            self.temporary_path = None
+
+
+def file_digest(content):
+    """sha256 hex digest of a Django ``File``, read in chunks and rewound."""
+    sha256 = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()
+
+
 def clear_folder(relative_path, purge=False):
     dir_name, file_name = os.path.split(relative_path)
     if os.path.exists(os.path.join(settings.MEDIA_ROOT, dir_name)):